@@ -1,4 +1,17 @@
 # -*- coding: utf-8 -*-
-from pjscrap import captcha
-from pjscrap import cej
-from pjscrap import utils
+import importlib
+
+# Submodules are imported on first access (PEP 562), so that "import
+# pjscrap" does not load OpenCV, Selenium, etc. in processes that never use
+# them.
+__all__ = ["captcha", "cej", "utils"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module("pjscrap." + name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
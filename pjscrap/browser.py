@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+import functools
+import os
+import sys
+
+from requests.exceptions import RequestException
+from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from pjscrap import captcha
+from pjscrap import detail
+from pjscrap import metrics
+from pjscrap import retry
+from pjscrap import validation
+from pjscrap.cej import BASE_URL
+from pjscrap.cej import CODE_INPUT_IDS
+from pjscrap.cej import DEFAULT_DOWNLOAD_WORKERS
+from pjscrap.cej import TARGET_PATH
+from pjscrap.cej import CejScraperSimple
+from pjscrap.cej import State
+from pjscrap.utils import copy_driver_cookies
+from pjscrap.utils import download_with_driver
+
+
+# Seconds to wait for the detail page after clicking the expediente.
+DETAIL_PAGE_TIMEOUT = 10
+# Every WebDriver call is an HTTP round trip to geckodriver, so the form is
+# driven with a few scripts instead of one call per element.
+FILL_FORM_SCRIPT = """
+document.getElementById("myTab").click();
+var values = arguments[0];
+for (var id in values) {
+    var input = document.getElementById(id);
+    input.value = values[id];
+    input.dispatchEvent(new Event("input", {bubbles: true}));
+    input.dispatchEvent(new Event("change", {bubbles: true}));
+}
+"""
+SUBMIT_CAPTCHA_SCRIPT = """
+var input = document.getElementById("codigoCaptcha");
+input.value = arguments[0];
+input.dispatchEvent(new Event("change", {bubbles: true}));
+document.getElementById("consultarExpedientes").click();
+"""
+# Returns the text of the visible error, or null while there is none.
+CAPTCHA_ERROR_SCRIPT = """
+var ids = ["codCaptchaError", "mensajeNoExisteExpedientes"];
+for (var i = 0; i < ids.length; i++) {
+    var elm = document.getElementById(ids[i]);
+    if (elm && (elm.offsetWidth || elm.offsetHeight ||
+                elm.getClientRects().length)) {
+        var text = elm.innerText.trim();
+        if (text) {
+            return text;
+        }
+    }
+}
+return null;
+"""
+# Returns null until the results are shown, then the button of the
+# expediente or "not_found". The button is clicked natively, so that the
+# click waits for the detail page like a user would.
+FIND_EXPEDIENTE_SCRIPT = """
+var main = document.getElementById("divDetalles");
+if (!main) {
+    return null;
+}
+for (var i = 0; i < main.children.length; i++) {
+    var div = main.children[i];
+    var b = div.tagName == "DIV" && div.getElementsByTagName("b")[0];
+    if (b && b.innerText.trim() == arguments[0]) {
+        var target = document.getElementsByClassName(div.classList[0])[0];
+        return target.getElementsByTagName("button")[0];
+    }
+}
+return "not_found";
+"""
+RESOLUCION_URLS_SCRIPT = """
+var links = document.getElementsByClassName("aDescarg");
+var urls = [];
+for (var i = 0; i < links.length; i++) {
+    urls.push(links[i].href);
+}
+return urls;
+"""
+
+
+class CejScraper:
+    def __init__(self, driver_pool, debug, solver=captcha.solve_detailed,
+                 validator=validation.check_file, base_url=BASE_URL,
+                 retry_policies=None, recorder=None, store=None,
+                 metadata_only=False):
+        self.driver_pool = driver_pool
+        self.base_url = base_url
+        self.driver = None
+        self._pooled = None
+        self.debug = debug
+        self.solver = solver
+        self.validator = validator
+        self.retry_policies = retry_policies
+        self.store = store
+        self.metadata_only = metadata_only
+        self.events = metrics.EventBuffer(recorder=recorder)
+        self._should_reload = False
+        self.error_message = ""
+        self.n_resoluciones = 0
+        self.transitions = []
+        self.downloads = []
+        self.record = None
+
+    @property
+    def log(self):
+        return self.events.format()
+
+    def run(self, expediente, output_dir, force, retries, should_reload=False):
+        self.error_message = ""
+        self.events.clear()
+        self.events.expediente = expediente
+        self.n_resoluciones = 0
+        self.downloads = []
+        self.record = None
+        self._should_reload = should_reload
+        try:
+            return self._run(expediente, output_dir, force, retries)
+        except Exception:
+            self._release_driver(crashed=True)
+            raise
+        finally:
+            self._release_driver()
+
+    def _run(self, expediente, output_dir, force, retries):
+        if self.metadata_only:
+            download_step = functools.partial(self._read_metadata, expediente)
+        else:
+            download_step = functools.partial(self._download_resoluciones,
+                                              output_dir, force)
+        steps = {
+            State.FETCH_CAPTCHA: self._browser_step(
+                functools.partial(self._load_fresh_form, expediente),
+                State.FETCH_CAPTCHA),
+            State.VALIDATE: self._browser_step(self._input_captcha,
+                                               State.FETCH_CAPTCHA),
+            State.SEARCH: self._browser_step(
+                functools.partial(self._click_lupa, expediente),
+                State.FETCH_CAPTCHA),
+            State.DOWNLOAD: self._browser_step(download_step, State.DOWNLOAD),
+        }
+        budget = retry.RetryBudget(retries, self.retry_policies)
+        machine = retry.StateMachine(steps, budget, State.FETCH_CAPTCHA,
+                                     State.FAILED)
+
+        state = machine.run(State.FETCH_CAPTCHA)
+        self.transitions = machine.transitions
+        self.events.log(retry.format_transitions(self.transitions))
+        if state == State.FAILED:
+            self.error_message = machine.error.message
+            if machine.error.outcome == retry.Outcome.ERROR:
+                print(machine.error.message, file=sys.stderr)
+            return False, False, budget.retries, 0
+
+        self.error_message = ""
+        return False, False, budget.retries, self.n_resoluciones
+
+    def _browser_step(self, step, retry_state):
+        def _step():
+            try:
+                return step()
+            except WebDriverException as ex:
+                next_state = retry_state
+                if self._pooled is not None:
+                    # The browser may be dead, so the retry starts over
+                    # with another driver.
+                    self._release_driver(crashed=True)
+                    self._should_reload = False
+                    next_state = State.FETCH_CAPTCHA
+                raise retry.StepError(retry.Outcome.BROWSER_ERROR,
+                                      "Browser error: %s" % str(ex).strip(),
+                                      next_state)
+        return _step
+
+    def _acquire_driver(self):
+        if self._pooled is None:
+            self._pooled = self.driver_pool.acquire()
+            self.driver = self._pooled.driver
+        return self.driver
+
+    def _release_driver(self, crashed=False):
+        if self._pooled is not None:
+            self.driver_pool.release(self._pooled, crashed)
+            self._pooled = None
+            self.driver = None
+
+    def _load_fresh_form(self, expediente):
+        self._acquire_driver()
+        return self._load_form(expediente)
+
+    def _load_form(self, expediente):
+        self.driver.delete_all_cookies()
+        if not self._should_reload:
+            self.driver.get(os.path.join(self.base_url, TARGET_PATH))
+        else:
+            self.driver.refresh()
+            self._should_reload = False
+
+        # Selects the CODIGO tab and fills the code.
+        self.driver.execute_script(
+            FILL_FORM_SCRIPT, dict(zip(CODE_INPUT_IDS, expediente.split("-"))))
+        return State.VALIDATE
+
+    def _capture_captcha(self, elm):
+        # The captcha never touches the disk: the screenshot is decoded in
+        # memory, so concurrent scrapers do not share any file.
+        try:
+            return captcha.decode_image(elm.screenshot_as_png)
+        except WebDriverException:
+            pass
+
+        x, y = int(elm.location['x']), int(elm.location['y'])
+        w, h = int(elm.size['width']), int(elm.size['height'])
+
+        self.driver.execute_script("window.scrollTo(0, 0)")
+        img = captcha.decode_image(self.driver.get_screenshot_as_png())
+        return img[y:y + h, x:x + w]
+
+    def _input_captcha(self):
+        self.driver.execute_script("window.scrollTo(0, 0)")
+
+        WebDriverWait(self.driver, 3).until(
+            EC.visibility_of_element_located((By.ID, "captcha_image")))
+        elm = self.driver.find_element_by_id("captcha_image")
+
+        captcha_img = self._capture_captcha(elm)
+        with self.events.timed(metrics.STAGE_CAPTCHA_SOLVE):
+            solution = self.solver(captcha_img, self.debug)
+
+        with self.events.timed(metrics.STAGE_VALIDATE) as span:
+            # Replaces the previous answer when the captcha is retried.
+            self.driver.execute_script(SUBMIT_CAPTCHA_SCRIPT, solution.text)
+            try:
+                error_message = WebDriverWait(self.driver, 1).until(
+                    lambda driver: driver.execute_script(
+                        CAPTCHA_ERROR_SCRIPT))
+            except TimeoutException:
+                error_message = ""
+            if error_message:
+                span.outcome = "rejected"
+        if not error_message:
+            return State.SEARCH
+
+        if "REFRESQUE LA PAGINA" in error_message:
+            self._should_reload = True
+            raise retry.StepError(retry.Outcome.EXPIRED_CAPTCHA,
+                                  error_message, State.FETCH_CAPTCHA)
+        if "No se encontraron registros con" in error_message:
+            raise retry.StepError(retry.Outcome.NOT_FOUND, error_message,
+                                  State.FETCH_CAPTCHA)
+        # The page shows a new captcha next to the error.
+        raise retry.StepError(retry.Outcome.WRONG_CAPTCHA, error_message,
+                              State.VALIDATE)
+
+    def _click_lupa(self, cod_exp):
+        with self.events.timed(metrics.STAGE_SEARCH):
+            return self.__click_lupa(cod_exp)
+
+    def __click_lupa(self, cod_exp):
+        button = WebDriverWait(self.driver, 3).until(
+            lambda driver: driver.execute_script(FIND_EXPEDIENTE_SCRIPT,
+                                                 cod_exp))
+        if button == "not_found":
+            raise retry.StepError(retry.Outcome.PARSE_ERROR,
+                                  "Expediente %s not found by the search" %
+                                  cod_exp,
+                                  State.FETCH_CAPTCHA)
+        button.click()
+        # The links and the metadata must not be read from the search page.
+        WebDriverWait(self.driver, DETAIL_PAGE_TIMEOUT).until(
+            EC.staleness_of(button))
+        return State.DOWNLOAD
+
+    def _read_metadata(self, expediente):
+        with self.events.timed(metrics.STAGE_DETAIL):
+            soup = detail.parse_metadata(self.driver.page_source)
+        self.record = detail.get_record(expediente, soup,
+                                        self.driver.current_url)
+        self.n_resoluciones = len(self.record["resoluciones"])
+        return State.DONE
+
+    def _download_resoluciones(self, output_dir, force):
+        self.downloads = []
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        urls = self.driver.execute_script(RESOLUCION_URLS_SCRIPT)
+        self.n_resoluciones = len(urls)
+        try:
+            for url in urls:
+                self.downloads.append(
+                    download_with_driver(self.driver, output_dir, url, force,
+                                         validator=self.validator,
+                                         events=self.events,
+                                         store=self.store))
+        except RequestException as ex:
+            raise retry.StepError(retry.Outcome.HTTP_ERROR,
+                                  "Download failed: %s" % ex, State.DOWNLOAD)
+
+        if not urls:
+            os.rmdir(output_dir)
+
+        return State.DONE
+
+
+class CejScraperHybrid(CejScraperSimple):
+    """Solves the captcha in the browser and hands the validated session
+    over to HTTP for the search, the detail and the downloads.
+
+    The driver goes back to the pool as soon as the captcha is accepted,
+    so the browser is only busy for the captcha.
+    """
+
+    def __init__(self, driver_pool, session, expediente, debug,
+                 solver=captcha.solve_detailed,
+                 validator=validation.check_file,
+                 download_workers=DEFAULT_DOWNLOAD_WORKERS, incremental=False,
+                 base_url=BASE_URL, captcha_session=None,
+                 retry_policies=None, throttle=None, recorder=None,
+                 store=None, metadata_only=False):
+        super().__init__(session, expediente, debug, solver,
+                         validator=validator,
+                         download_workers=download_workers,
+                         incremental=incremental, base_url=base_url,
+                         captcha_session=captcha_session,
+                         retry_policies=retry_policies, throttle=throttle,
+                         recorder=recorder, store=store,
+                         metadata_only=metadata_only)
+        self.driver_pool = driver_pool
+        self.browser = CejScraper(driver_pool, debug, solver, validator,
+                                  base_url)
+        self.browser.events = self.events
+
+    def run(self, output_dir, force, retries, should_reload=False):
+        self.browser._should_reload = should_reload
+        try:
+            return super().run(output_dir, force, retries)
+        finally:
+            self._release_driver()
+
+    def _steps(self, output_dir, force):
+        steps = super()._steps(output_dir, force)
+        steps[State.FETCH_CAPTCHA] = self.browser._browser_step(
+            self._load_form, State.FETCH_CAPTCHA)
+        steps[State.VALIDATE] = self.browser._browser_step(
+            self._input_captcha, State.FETCH_CAPTCHA)
+        return steps
+
+    def _release_driver(self, crashed=False):
+        self.browser._release_driver(crashed)
+
+    def _load_form(self):
+        if self.captcha_session is not None:
+            self.captcha_session.invalidate()
+        # A browser error releases the driver as crashed, so the retry
+        # starts over with another one.
+        return self.browser._load_fresh_form(self.expediente)
+
+    def _input_captcha(self):
+        state = self.browser._input_captcha()
+
+        # The JSESSIONID validated by the browser is all the server checks.
+        copy_driver_cookies(self.browser.driver, self.session)
+        self._release_driver()
+        if self.captcha_session is not None:
+            self.captcha_session.validate()
+        return state
@@ -1,58 +1,321 @@
 # -*- coding: utf-8 -*-
 # pylint: disable=missing-module-docstring
-import cv2
-import numpy as np
-import pytesseract
+import json
+import os
+import threading
+from collections import namedtuple
+
 from PIL import Image
 
+# cv2, numpy and the OCR engines are imported where they are used, so that
+# processes that only hand captchas to a PoolSolver never load them.
+
+
+WHITELIST = "0123456789ABCDEFGHIJKLMNPQRTUVWXYZ"
+TESSERACT_PSM = 13
+TESSERACT_OEM = 2
+DEFAULT_BACKEND = os.environ.get("PJSCRAP_CAPTCHA_BACKEND") or "auto"
+TEMPLATE_MODEL_PATH = os.environ.get("PJSCRAP_CAPTCHA_MODEL")
+PROFILE_PATH = os.environ.get("PJSCRAP_CAPTCHA_PROFILE")
+
+
+Solution = namedtuple("Solution", ["text", "confidence", "n_chars"])
+Profile = namedtuple("Profile", ["name", "crop_left", "threshold",
+                                 "kernel_size", "padding", "oem"])
+
+DEFAULT_PROFILE = Profile("default", crop_left=10, threshold=150,
+                          kernel_size=4, padding=10, oem=TESSERACT_OEM)
+
+
+def load_profile(path):
+    with open(path) as profile_file:
+        return Profile(**json.load(profile_file))
+
+
+def save_profile(profile, path):
+    with open(path, "w") as profile_file:
+        json.dump(profile._asdict(), profile_file, indent=2)
+
+
+_default_profile = None
+
+
+def get_default_profile():
+    global _default_profile
+    if _default_profile is None:
+        _default_profile = \
+            load_profile(PROFILE_PATH) if PROFILE_PATH else DEFAULT_PROFILE
+    return _default_profile
+
+
+class PytesseractBackend:
+    name = "pytesseract"
+
+    def __init__(self, oem=TESSERACT_OEM):
+        import pytesseract
+        self._pytesseract = pytesseract
+        # Raises TesseractNotFoundError (an OSError) now rather than on the
+        # first captcha if the tesseract binary is missing.
+        pytesseract.get_tesseract_version()
+        self.config_args = " ".join([
+            "--psm", str(TESSERACT_PSM),
+            "--oem", str(oem),
+            "-c", "tessedit_char_whitelist=%s" % WHITELIST
+        ])
+
+    def recognize(self, img):
+        import cv2
+        pytesseract = self._pytesseract
+        img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_GRAY2RGB))
+        data = pytesseract.image_to_data(img, config=self.config_args,
+                                         output_type=pytesseract.Output.DICT)
+
+        words = []
+        confidences = []
+        for text, conf in zip(data["text"], data["conf"]):
+            conf = float(conf)
+            if conf < 0 or not text.strip():
+                continue
+            words.append(text.strip())
+            confidences.append(conf)
+
+        if not words:
+            return "", 0.0
+        return "".join(words), min(confidences) / 100
+
+
+class TesserocrBackend:
+    name = "tesserocr"
+
+    def __init__(self, oem=TESSERACT_OEM):
+        import tesserocr
+        self._tesserocr = tesserocr
+        self.oem = oem
+        # PyTessBaseAPI is not thread safe, so every thread gets its own
+        # engine. It is created once and reused for every captcha.
+        self._local = threading.local()
+        # Raises RuntimeError now if the engine or its data are missing.
+        self._get_api()
+
+    def _get_api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self._tesserocr.PyTessBaseAPI(psm=TESSERACT_PSM,
+                                                oem=self.oem)
+            api.SetVariable("tessedit_char_whitelist", WHITELIST)
+            self._local.api = api
+        return api
+
+    def recognize(self, img):
+        api = self._get_api()
+        api.SetImage(Image.fromarray(img))
+        return api.GetUTF8Text(), api.MeanTextConf() / 100
+
+
+class TemplateBackend:
+    name = "template"
+
+    # The engine mode only applies to Tesseract, it is accepted for
+    # compatibility with the other backends.
+    def __init__(self, oem=None, model_path=None):
+        from pjscrap import glyphs
+        self._glyphs = glyphs
+
+        model_path = model_path or TEMPLATE_MODEL_PATH
+        if not model_path:
+            raise ValueError("The template backend needs a model, set "
+                             "PJSCRAP_CAPTCHA_MODEL to its path")
+        self.classifier = glyphs.TemplateClassifier.load(model_path)
+
+    def recognize(self, img):
+        labels, distances = self.classifier.predict(self._glyphs.segment(img))
+        return "".join(labels), self._glyphs.confidence(distances)
+
+    def solve_batch(self, images, profile=None):
+        return self._glyphs.solve_batch(images, self.classifier, profile)
+
+
+BACKENDS = {
+    PytesseractBackend.name: PytesseractBackend,
+    TesserocrBackend.name: TesserocrBackend,
+    TemplateBackend.name: TemplateBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None, oem=TESSERACT_OEM):
+    key = (name or DEFAULT_BACKEND, oem)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = _create_backend(*key)
+        return _backends[key]
+
+
+# Tried in order by the "auto" backend.
+AUTO_BACKENDS = (TesserocrBackend, PytesseractBackend, TemplateBackend)
+# What the backends raise when their engine, its data or their model are
+# missing.
+UNAVAILABLE_ERRORS = (ImportError, OSError, RuntimeError, ValueError)
+
+
+def _create_backend(name, oem):
+    if name == "auto":
+        errors = []
+        for backend_class in AUTO_BACKENDS:
+            try:
+                return backend_class(oem)
+            except UNAVAILABLE_ERRORS as ex:
+                errors.append("%s: %s" % (backend_class.name, ex))
+        raise ValueError("No captcha backend available (%s)" %
+                         "; ".join(errors))
+
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown captcha backend: %s" % name)
+    return backend_class(oem)
+
+
+def decode_image(data):
+    import cv2
+    import numpy as np
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def to_opencv_image(path_or_img):
+    import cv2
+    import numpy as np
+    if isinstance(path_or_img, Image.Image):
+        rgb_img = np.array(path_or_img)
+        bgr_img = rgb_img[:, :, ::-1].copy()
+        return bgr_img
+    elif isinstance(path_or_img, str):
+        return cv2.imread(path_or_img)
+    elif isinstance(path_or_img, np.ndarray):
+        return path_or_img
+    return None
+
+
+def preprocess(path_or_img, show_process=False, profile=None):
+    import cv2
+    import numpy as np
 
-def solve(path_or_img, show_process=False):
     def _try_display():
         if show_process:
             cv2.imshow('img', img)
             cv2.waitKey(0)
             cv2.destroyAllWindows()
 
-    def _to_opencv_image(path_or_img):
-        if isinstance(path_or_img, Image.Image):
-            rgb_img = np.array(path_or_img)
-            bgr_img = rgb_img[:, :, ::-1].copy()
-            return bgr_img
-        elif isinstance(path_or_img, str):
-            return cv2.imread(path_or_img)
-        elif isinstance(path_or_img, np.ndarray):
-            return path_or_img
-        return None
+    profile = profile or get_default_profile()
 
-    img = _to_opencv_image(path_or_img)
+    img = to_opencv_image(path_or_img)
     if img is None:
-        return ""
+        return None
 
-    img = img[0:, 10:]
+    img = img[0:, profile.crop_left:]
     img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     _try_display()
 
-    _, img = cv2.threshold(img, 150, 255, cv2.THRESH_BINARY)
+    _, img = cv2.threshold(img, profile.threshold, 255, cv2.THRESH_BINARY)
     _try_display()
 
     img = cv2.bitwise_not(img)
     _try_display()
 
-    kernel = np.ones((4, 4), np.uint8)
+    kernel = np.ones((profile.kernel_size, profile.kernel_size), np.uint8)
     img = cv2.erode(img, kernel, iterations=1)
     _try_display()
 
-    img = cv2.copyMakeBorder(img, 10, 10, 10, 10, cv2.BORDER_CONSTANT,
-                             value=[255, 0, 0])
+    img = _add_padding(img, profile)
     _try_display()
 
-    img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_GRAY2RGB))
+    return img
+
+
+def preprocess_batch(grays, profile):
+    # Vectorized equivalent of preprocess for a stack of grayscale captchas
+    # of the same size, shaped (n, height, width).
+    import cv2
+    import numpy as np
+    grays = grays[:, :, profile.crop_left:]
+    inverted = np.where(grays > profile.threshold, 0, 255).astype(np.uint8)
+
+    kernel = np.ones((profile.kernel_size, profile.kernel_size), np.uint8)
+    return [_add_padding(cv2.erode(img, kernel, iterations=1), profile)
+            for img in inverted]
 
-    config_args = " ".join([
-        "--psm", "13",
-        "--oem", "2",
-        "-c", "tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNPQRTUVWXYZ"
-    ])
-    text = pytesseract.image_to_string(img, config=config_args).upper()
 
-    return text.strip()
+def _add_padding(img, profile):
+    import cv2
+    padding = profile.padding
+    return cv2.copyMakeBorder(img, padding, padding, padding, padding,
+                              cv2.BORDER_CONSTANT, value=[255, 0, 0])
+
+
+def solve_detailed(path_or_img, show_process=False, backend=None,
+                   profile=None):
+    profile = profile or get_default_profile()
+    img = preprocess(path_or_img, show_process, profile)
+    if img is None:
+        return Solution("", 0.0, 0)
+
+    if not hasattr(backend, "recognize"):
+        backend = get_backend(backend, profile.oem)
+    text, confidence = backend.recognize(img)
+    text = text.upper().strip()
+
+    return Solution(text, confidence, len(text))
+
+
+def solve(path_or_img, show_process=False, backend=None, profile=None):
+    return solve_detailed(path_or_img, show_process, backend, profile).text
+
+
+def solve_batch(images, backend=None, profile=None):
+    profile = profile or get_default_profile()
+    if not hasattr(backend, "recognize"):
+        backend = get_backend(backend, profile.oem)
+    if hasattr(backend, "solve_batch"):
+        return backend.solve_batch(images, profile)
+    return [solve(img, backend=backend, profile=profile) for img in images]
+
+
+class PoolSolver:
+    def __init__(self, executor, backend=None, profile=None):
+        self.executor = executor
+        self.backend = backend
+        self.profile = profile
+
+    def __call__(self, path_or_img, show_process=False):
+        future = self.executor.submit(solve_detailed, path_or_img,
+                                      show_process, self.backend,
+                                      self.profile)
+        return future.result()
+
+
+class SolutionFilter:
+    def __init__(self, expected_length=None, min_confidence=0.0,
+                 max_refetch=5):
+        self.expected_length = expected_length
+        self.min_confidence = min_confidence
+        self.max_refetch = max_refetch
+
+    def rejection_reason(self, solution):
+        if not solution.n_chars:
+            return "empty answer"
+        if self.expected_length and solution.n_chars != self.expected_length:
+            return "expected %d characters, got %d" %\
+                (self.expected_length, solution.n_chars)
+        invalid_chars = set(solution.text) - set(WHITELIST)
+        if invalid_chars:
+            return "characters out of the whitelist: %s" %\
+                "".join(sorted(invalid_chars))
+        if solution.confidence < self.min_confidence:
+            return "confidence %.2f below %.2f" %\
+                (solution.confidence, self.min_confidence)
+        return None
+
+    def accepts(self, solution):
+        return self.rejection_reason(solution) is None
@@ -1,377 +1,472 @@
 # -*- coding: utf-8 -*-
-import argparse
+import functools
+import hashlib
 import io
+import json
 import os
 import sys
-import tempfile
-import traceback
+from concurrent.futures import ThreadPoolExecutor
 from enum import auto
 from enum import Enum
 
-import requests
-from bs4 import BeautifulSoup
 from PIL import Image
 from requests.exceptions import RequestException
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
 
 from pjscrap import captcha
-from pjscrap.utils import check_valid_file
-from pjscrap.utils import download_with_driver
+from pjscrap import detail
+from pjscrap import metrics
+from pjscrap import retry
+from pjscrap import throttle as throttling
+from pjscrap import validation
+from pjscrap.prefetch import PrefetchError
 from pjscrap.utils import download_with_session
-from pjscrap.utils import get_request_session
 
 
-BASE_URL = "https://cej.pj.gob.pe/cej/"
-TARGET_URL = "https://cej.pj.gob.pe/cej/forms/busquedaform.html"
-CAPTCHA_URL = "https://cej.pj.gob.pe/cej/Captcha.jpg"
-CEJ_FULL_SCREENSHOT_PATH =\
-    os.environ.get("CEJ_FULL_SCREENSHOT_PATH") or "/tmp/pj_ce.png"
-CEJ_CAPTCHA_SCREENSHOT_PATH =\
-    os.environ.get("CEJ_CAPTCHA_SCREENSHOT_PATH") or "/tmp/pj_ce_captcha.png"
+BASE_URL = os.environ.get("CEJ_BASE_URL") or "https://cej.pj.gob.pe/cej/"
+TARGET_PATH = "forms/busquedaform.html"
+CAPTCHA_PATH = "Captcha.jpg"
+TARGET_URL = os.path.join(BASE_URL, TARGET_PATH)
+CAPTCHA_URL = os.path.join(BASE_URL, CAPTCHA_PATH)
+DEFAULT_DOWNLOAD_WORKERS = 4
+LISTING_FILENAME = ".listing.json"
+# Outcome recorded for each answer of ValidarFiltrosCodigo.htm.
+VALIDATION_OUTCOMES = {
+    b"1": metrics.OUTCOME_OK,
+    b"2": "not_found",
+    b"-C": "wrong_captcha",
+    b"-CV": "expired_captcha",
+    b"-CM": "captcha_problem",
+}
+CODE_INPUT_IDS = ("cod_expediente", "cod_anio", "cod_incidente",
+                  "cod_distprov", "cod_organo", "cod_especialidad",
+                  "cod_instancia")
+
+
+class CaptchaSession:
+    """Keeps track of the captcha validated on a session, so that further
+    expedientes can be searched without solving a new one."""
+
+    def __init__(self, session):
+        self.session = session
+        self.validated = False
+        # Number of expedientes searched with each validated captcha.
+        self.coverage = []
+
+    def validate(self):
+        self.validated = True
+        self.coverage.append(0)
+
+    def invalidate(self):
+        self.validated = False
 
+    def cover(self):
+        if self.validated:
+            self.coverage[-1] += 1
 
-class Tab(Enum):
-    FILTRO = auto()
-    CODIGO = auto()
+
+class State(Enum):
+    FETCH_CAPTCHA = auto()
+    VALIDATE = auto()
+    SEARCH = auto()
+    DETAIL = auto()
+    DOWNLOAD = auto()
+    DONE = auto()
+    FAILED = auto()
 
 
 class CejScraperSimple:
-    def __init__(self, session, expediente, debug):
+    def __init__(self, session, expediente, debug,
+                 solver=captcha.solve_detailed, solution_filter=None,
+                 corpus=None, prefetcher=None,
+                 validator=validation.check_file,
+                 download_workers=DEFAULT_DOWNLOAD_WORKERS, incremental=False,
+                 base_url=BASE_URL, captcha_session=None,
+                 retry_policies=None, throttle=None, recorder=None,
+                 store=None, metadata_only=False):
         self.session = session
         self.expediente = expediente
         self.debug = debug
+        self.solver = solver
+        self.solution_filter = solution_filter or captcha.SolutionFilter()
+        self.corpus = corpus
+        self.prefetcher = prefetcher
+        self.validator = validator
+        self.download_workers = download_workers
+        self.incremental = incremental
+        self.base_url = base_url
+        self.captcha_session = captcha_session
+        self.retry_policies = retry_policies
+        self.throttle = throttle or throttling.UNLIMITED
+        self.store = store
+        self.metadata_only = metadata_only
+        self.events = metrics.EventBuffer(expediente, recorder)
+        self._captcha_image = None
+        self._answer = None
+        self._nro_registro = None
+        self._link_tags = None
         self.error_message = ""
-        self.log = ""
+        self.n_avoided_submits = 0
+        self.n_new_resoluciones = None
+        self.n_resoluciones = 0
+        self.reused_captcha = False
+        self.transitions = []
+        self.downloads = []
+        self.record = None
+
+    @property
+    def log(self):
+        return self.events.format()
 
     def run(self, output_dir, force, retries, should_reload=False):
         self.error_message = ""
-        self.log = ""
-        return self._run(output_dir, force, retries, should_reload)
+        self.events.clear()
+        self.n_avoided_submits = 0
+        self.n_new_resoluciones = None
+        self.n_resoluciones = 0
+        self.reused_captcha = False
+        self.downloads = []
+        self.record = None
+
+        budget = retry.RetryBudget(retries, self.retry_policies)
+        machine = retry.StateMachine(self._steps(output_dir, force), budget,
+                                     State.FETCH_CAPTCHA, State.FAILED)
+
+        state = State.FETCH_CAPTCHA
+        if self.captcha_session is not None and \
+                self.captcha_session.validated:
+            self.reused_captcha = True
+            state = State.SEARCH
+
+        state = machine.run(state)
+        self.transitions = machine.transitions
+        self.events.log(retry.format_transitions(self.transitions))
+        if state == State.FAILED:
+            self.error_message = machine.error.message
+            if machine.error.outcome == retry.Outcome.ERROR:
+                print(machine.error.message, file=sys.stderr)
+            return False, False, budget.retries, 0
 
-    def _run(self, output_dir, force, retries, should_reload):
-        try:
-            return self.__run(output_dir, force, retries, should_reload)
-        except Exception:
-            self.log += traceback.format_exc()
-            traceback.print_exc()
-            ret = self._run(output_dir, force, retries - 1, should_reload)
-        return ret
-
-    def __run(self, output_dir, force, retries,
-              should_reload):
-        should_continue, should_reload, retries = self._input_captcha(retries)
-
-        n_downloads = 0
-        if should_continue:
-            if should_reload:
-                should_continue, should_reload, retries, n_downloads = \
-                    self.__run(output_dir, force, retries, should_reload)
-            if should_continue and (not should_reload) and retries > 0:
-                n_downloads = self._download_resoluciones(output_dir, force)
-                return False, False, retries, n_downloads
-
-        return should_continue, should_reload, retries, n_downloads
-
-    def _input_captcha(self, retries):
-        if retries == 0:
-            return False, False, 0
-
-        res = self.session.get(CAPTCHA_URL)
-        captcha_img = Image.open(io.BytesIO(res.content))
-        decoded_captcha = captcha.solve(captcha_img, self.debug)
+        self.error_message = ""
+        return False, False, budget.retries, self.n_resoluciones
+
+    def _steps(self, output_dir, force):
+        return {
+            State.FETCH_CAPTCHA: self._solve_captcha,
+            State.VALIDATE: self._input_captcha,
+            State.SEARCH: self._search,
+            State.DETAIL: self._get_detail,
+            State.DOWNLOAD: functools.partial(self._download_resoluciones,
+                                              output_dir, force),
+        }
 
+    def _input_captcha(self):
         base_data = self._get_base_request_data()
         extra_data = {
             "navegador": "Chrome--87",
             "divKcha": "0",
             "sCUJ": "",
-            "codigoCaptcha": decoded_captcha,
+            "codigoCaptcha": self._answer,
         }
 
         data = dict(base_data, **extra_data)
-        url = os.path.join(BASE_URL, "forms/ValidarFiltrosCodigo.htm")
+        url = os.path.join(self.base_url, "forms/ValidarFiltrosCodigo.htm")
 
+        # A captcha can only be submitted once, so every failure needs a new
+        # one.
         try:
-            res = self.session.post(url, data=data)
+            with self.events.timed(metrics.STAGE_VALIDATE) as span, \
+                    self.throttle.slot(throttling.KIND_CAPTCHA) as ticket:
+                res = self.session.post(url, data=data)
+                ticket.observe(res)
+                span.outcome = metrics.http_outcome(res)
+                if res.status_code == 200:
+                    span.outcome = VALIDATION_OUTCOMES.get(res.content,
+                                                           "unknown")
+                # The server answers "-CM" when it struggles with captchas.
+                if res.content == b"-CM":
+                    ticket.overloaded = True
         except RequestException as ex:
-            self.error_message =\
-                "Captcha request raised an exception message: %s" % ex
-            return False, False, retries - 1
+            raise retry.StepError(
+                retry.Outcome.HTTP_ERROR,
+                "Captcha request raised an exception message: %s" % ex,
+                State.FETCH_CAPTCHA)
 
         if res.status_code != 200:
-            self.error_message =\
-                "Captcha request returned with status code %d" % res.status_code
-            self.log += "%s\n" % self.error_message
-            return retries != 0, True, retries - 1
+            raise retry.StepError(
+                retry.Outcome.HTTP_ERROR,
+                "Captcha request returned with status code %d" %
+                res.status_code,
+                State.FETCH_CAPTCHA)
 
         try:
             result = res.content.decode("utf-8")
         except UnicodeError:
-            pass
+            result = ""
+
+        if self.corpus is not None:
+            self.corpus.record(self._captcha_image, self._answer, result)
+
+        if result == "1":
+            if self.captcha_session is not None:
+                self.captcha_session.validate()
+            return State.SEARCH
 
         if result == "-CV":
             front_end_msg = "Captcha enviado incorrecto, REFRESQUE LA PAGINA"
+            outcome = retry.Outcome.EXPIRED_CAPTCHA
         elif result == "-CM":
             front_end_msg = ("Problemas con el Captcha, de ser reiterativo "
                              "REFRESQUE LA PAGINA")
+            outcome = retry.Outcome.EXPIRED_CAPTCHA
         elif result == "-C":
             front_end_msg = "Ingrese el Codigo de Captcha Correcto"
+            outcome = retry.Outcome.WRONG_CAPTCHA
         elif result == "2":
             front_end_msg = ("No se encontraron registros con con los datos "
                              "ingresados")
-        elif result != "1":
-            front_end_msg = "Unknown error"
-        else:
-            front_end_msg = ""
-
-        if front_end_msg:
-            error_msg_tmpl = "Captcha request returned '%s'. It may lead to: %s"
-            self.error_message = error_msg_tmpl % (result, front_end_msg)
-            self.log += "%s\n" % self.error_message
+            outcome = retry.Outcome.NOT_FOUND
         else:
-            self.error_message = ""
-
-        if result == "-C":
-            return self._input_captcha(retries - 1)
-        elif result == "2":
-            return False, False, retries - 1
-        elif result != "1":
-            return retries != 0, True, retries - 1
-
-        return retries != 0, False, retries - 1
-
-    def _get_base_request_data(self):
-        sub_codes = self.expediente.split("-")
-        input_ids = ("cod_expediente", "cod_anio", "cod_incidente",
-                     "cod_distprov", "cod_organo", "cod_especialidad",
-                     "cod_instancia")
-        return dict(zip(input_ids, sub_codes))
-
-    def _download_resoluciones(self, output_dir, force):
-        if not force and check_valid_file(output_dir):
-            return
+            front_end_msg = "Unknown error"
+            outcome = retry.Outcome.ERROR
 
-        data = self._get_base_request_data()
-        headers = {
-            "Cookie": "JSESSIONID=%s" % self.session.cookies.get("JSESSIONID"),
-        }
-        url = os.path.join(BASE_URL, "forms/busquedacodform.html")
-        res = self.session.post(url, data=data, headers=headers)
+        error_msg_tmpl = "Captcha request returned '%s'. It may lead to: %s"
+        raise retry.StepError(outcome, error_msg_tmpl % (result, front_end_msg),
+                              State.FETCH_CAPTCHA)
 
-        soup = BeautifulSoup(res.content, "html.parser")
-        main_div = soup.find("div", {"id": "divDetalles"})
+    def _solve_captcha(self):
+        for n_fetch in range(self.solution_filter.max_refetch + 1):
+            solution = self._fetch_captcha()
 
-        nro_registro = None
-        for div in main_div:
-            b_ = div.find("b")
-            if b_ != -1 and b_.text == self.expediente:
-                nro_registro = div.find("input").get("value")
+            reason = self.solution_filter.rejection_reason(solution)
+            if reason is None:
+                break
+            if n_fetch == self.solution_filter.max_refetch:
+                self.events.log("Submitting '%s' anyway: %s" %
+                                (solution.text, reason))
                 break
 
-        data = {"nroRegistro": nro_registro}
-        url = os.path.join(BASE_URL, "forms/detalleform.html")
-        res = self.session.post(url, data=data, headers=headers)
-
-        soup = BeautifulSoup(res.content, "html.parser")
-        link_tags = soup.findAll("a", {"class": "aDescarg"})
-
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        for tag in link_tags:
-            url = os.path.join(BASE_URL, "forms", tag.get("href"))
-            download_with_session(self.session, output_dir, url, force)
-
-        if not link_tags:
-            os.rmdir(output_dir)
-        return len(link_tags)
+            self.events.log("Captcha '%s' rejected locally: %s" %
+                            (solution.text, reason))
+            self.n_avoided_submits += 1
 
+        self._answer = solution.text
+        return State.VALIDATE
 
-class CejScraper:
-    def __init__(self, firefox_driver, debug):
-        self.driver = firefox_driver
-        self.debug = debug
-        self.error_message = ""
-        self.log = ""
+    def _fetch_captcha(self):
+        # A new captcha replaces the one validated on the session.
+        if self.captcha_session is not None:
+            self.captcha_session.invalidate()
 
-    def run(self, expediente, output_dir, force, retries, should_reload=False):
-        self.error_message = ""
-        self.log = ""
-        return self._run(expediente, output_dir, force, retries, should_reload)
+        if self.prefetcher is not None:
+            try:
+                prefetched = self.prefetcher.get()
+            except PrefetchError as ex:
+                raise retry.StepError(retry.Outcome.ERROR,
+                                      "Captcha prefetch failed: %s" % ex,
+                                      State.FETCH_CAPTCHA)
+            # The answer is only valid for the session it was served with.
+            self.session.cookies.clear()
+            self.session.cookies.update(prefetched.cookies)
+            self._captcha_image = prefetched.image
+            # The prefetcher recorded the fetch and solve spans.
+            self.events.log("Captcha prefetched")
+            return prefetched.solution
 
-    def _run(self, expediente, output_dir, force, retries, should_reload):
         try:
-            ret = self.__run(expediente, output_dir, force, retries,
-                             should_reload)
-        except Exception:
-            self.log += traceback.format_exc()
-            traceback.print_exc()
-            ret = self._run(expediente, output_dir, force, retries - 1,
-                            should_reload)
-        return ret
-
-    def __run(self, expediente, output_dir, force, retries, should_reload):
-        self._log_retries(retries)
-        if retries == 0:
-            return False, False, 0, 0
-
-        self.driver.delete_all_cookies()
-        if not should_reload:
-            self.driver.get(TARGET_URL)
-        else:
-            self.driver.refresh()
-
-        self._click_tab(Tab.CODIGO)
-        self._input_codigo_expediente(expediente)
-        should_continue, should_reload, retries = self._input_captcha(retries)
-
-        if should_continue:
-            if should_reload:
-                should_continue, should_reload, retries, _ = \
-                    self.__run(expediente, output_dir, force, retries,
-                               should_reload)
-            if should_continue and (not should_reload) and retries > 0:
-                self._click_lupa(expediente)
-                n_downloads = self._download_resoluciones(output_dir, force)
-                return False, False, retries, n_downloads
-
-        return should_continue, should_reload, retries, 0
-
-    def _log_retries(self, retries):
-        self.log += "Retry: %d\n" % retries
-
-    def _click_tab(self, tab):
-        if tab != Tab.CODIGO:
-            raise NotImplementedError()
-
-        elm = self.driver.find_element_by_id("myTab")
-        elm.click()
-
-    def _input_codigo_expediente(self, cod_exp):
-        sub_codes = cod_exp.split("-")
-        input_ids = ("cod_expediente", "cod_anio", "cod_incidente",
-                     "cod_distprov", "cod_organo", "cod_especialidad",
-                     "cod_instancia")
+            with self.events.timed(metrics.STAGE_CAPTCHA_FETCH) as span, \
+                    self.throttle.slot(throttling.KIND_CAPTCHA) as ticket:
+                res = self.session.get(os.path.join(self.base_url,
+                                                    CAPTCHA_PATH))
+                ticket.observe(res)
+                span.outcome = metrics.http_outcome(res)
+                span.bytes = len(res.content)
+            res.raise_for_status()
+        except RequestException as ex:
+            raise retry.StepError(retry.Outcome.HTTP_ERROR,
+                                  "Captcha download failed: %s" % ex,
+                                  State.FETCH_CAPTCHA)
 
-        for input_id, sub_cod in zip(input_ids, sub_codes):
-            elm = self.driver.find_element_by_id(input_id)
-            elm.send_keys(sub_cod)
+        self._captcha_image = res.content
+        try:
+            captcha_img = Image.open(io.BytesIO(res.content))
+        except OSError as ex:
+            raise retry.StepError(retry.Outcome.PARSE_ERROR,
+                                  "Captcha image is not valid: %s" % ex,
+                                  State.FETCH_CAPTCHA)
+        with self.events.timed(metrics.STAGE_CAPTCHA_SOLVE):
+            return self.solver(captcha_img, self.debug)
 
-    def _extract_captcha_to_filename(self, elm, captcha_output):
-        x, y = elm.location['x'], elm.location['y']
-        w, h = elm.size['width'], elm.size['height']
+    def _get_base_request_data(self):
+        return dict(zip(CODE_INPUT_IDS, self.expediente.split("-")))
 
-        self.driver.execute_script("window.scrollTo(0, 0)")
-        self.driver.save_screenshot(CEJ_FULL_SCREENSHOT_PATH)
+    def _get_session_headers(self):
+        return {
+            "Cookie": "JSESSIONID=%s" % self.session.cookies.get("JSESSIONID"),
+        }
 
-        img = Image.open(CEJ_FULL_SCREENSHOT_PATH)
-        img = img.crop((int(x), int(y), int(x + w), int(y + h)))
-        img.save(captcha_output)
+    def _post(self, path, data, stage, retry_state):
+        url = os.path.join(self.base_url, path)
+        try:
+            with self.events.timed(stage) as span, \
+                    self.throttle.slot(throttling.KIND_SEARCH) as ticket:
+                res = self.session.post(url, data=data,
+                                        headers=self._get_session_headers())
+                ticket.observe(res)
+                span.outcome = metrics.http_outcome(res)
+                span.bytes = len(res.content)
+            res.raise_for_status()
+        except RequestException as ex:
+            raise retry.StepError(retry.Outcome.HTTP_ERROR,
+                                  "Request to %s failed: %s" % (path, ex),
+                                  retry_state)
+        return res
 
-    def _input_captcha(self, retries):
-        if retries == 0:
-            return False, False, 0
+    def _search(self):
+        data = self._get_base_request_data()
+        res = self._post("forms/busquedacodform.html", data,
+                         metrics.STAGE_SEARCH, State.SEARCH)
 
-        self.driver.execute_script("window.scrollTo(0, 0)")
+        soup = detail.parse_search(res.content)
+        main_div = soup.find("div", {"id": "divDetalles"})
 
-        WebDriverWait(self.driver, 3).until(
-            EC.visibility_of_element_located((By.ID, "captcha_image")))
-        elm = self.driver.find_element_by_id("captcha_image")
+        for div in main_div or ():
+            b_ = div.find("b")
+            if b_ != -1 and b_ is not None and b_.text == self.expediente:
+                if self.captcha_session is not None:
+                    self.captcha_session.cover()
+                self._nro_registro = div.find("input").get("value")
+                return State.DETAIL
+
+        if self.reused_captcha and self.captcha_session.validated:
+            if main_div is not None:
+                # An empty listing is a valid answer on a validated session:
+                # the expediente does not exist and the session is kept.
+                self.captcha_session.cover()
+                raise retry.StepError(
+                    retry.Outcome.NOT_FOUND,
+                    "Search returned no listing. It may lead to: No se "
+                    "encontraron registros con con los datos ingresados",
+                    State.FETCH_CAPTCHA)
+            # Without a listing the server dropped the validation.
+            self.captcha_session.invalidate()
+            self.reused_captcha = False
+            raise retry.StepError(retry.Outcome.SESSION_REJECTED,
+                                  "Validated session rejected",
+                                  State.FETCH_CAPTCHA)
+        raise retry.StepError(retry.Outcome.PARSE_ERROR,
+                              "Expediente %s not found by the search" %
+                              self.expediente,
+                              State.FETCH_CAPTCHA)
+
+    def _get_detail(self):
+        data = {"nroRegistro": self._nro_registro}
+        res = self._post("forms/detalleform.html", data,
+                         metrics.STAGE_DETAIL, State.DETAIL)
+
+        if self.metadata_only:
+            soup = detail.parse_metadata(res.content)
+            self.record = detail.get_record(self.expediente, soup, res.url)
+            self.n_resoluciones = len(self.record["resoluciones"])
+            return State.DONE
+
+        soup = detail.parse_detail(res.content)
+        self._link_tags = soup.findAll("a", {"class": "aDescarg"})
+        return State.DOWNLOAD
 
-        self.driver.save_screenshot(CEJ_FULL_SCREENSHOT_PATH)
+    def _download_resoluciones(self, output_dir, force):
+        link_tags = self._link_tags
+        self.downloads = []
+
+        listing = get_listing(link_tags)
+        self.n_resoluciones = len(listing["entries"])
+        listing_path = os.path.join(output_dir, LISTING_FILENAME)
+        forced_hrefs = set()
+        if self.incremental and not force:
+            previous = load_listing(listing_path)
+            if previous.get("fingerprint") == listing["fingerprint"]:
+                self.events.log("Listing unchanged, nothing to download")
+                self.n_new_resoluciones = 0
+                return State.DONE
+
+            previous_entries = previous.get("entries", {})
+            entries = listing["entries"]
+            link_tags = [tag for tag in link_tags
+                         if previous_entries.get(tag.get("href")) !=
+                         entries[tag.get("href")]]
+            # Changed entries may keep their filename, so they must be
+            # fetched again even if the old file is valid.
+            forced_hrefs = {tag.get("href") for tag in link_tags
+                            if tag.get("href") in previous_entries}
+            self.n_new_resoluciones = len(link_tags)
 
-        x, y = elm.location['x'], elm.location['y']
-        w, h = elm.size['width'], elm.size['height']
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
 
-        img = Image.open(CEJ_FULL_SCREENSHOT_PATH)
-        img = img.crop((int(x), int(y), int(x + w), int(y + h)))
-        img.save(CEJ_CAPTCHA_SCREENSHOT_PATH)
+        def _download(tag):
+            url = os.path.join(self.base_url, "forms", tag.get("href"))
+            return download_with_session(
+                self.session, output_dir, url,
+                force or tag.get("href") in forced_hrefs,
+                validator=self.validator, throttle=self.throttle,
+                events=self.events, store=self.store)
+
+        # Files are fetched concurrently over the connection pool of the
+        # session, so the expediente takes about as long as its slowest file.
+        # Files that completed are skipped when the step is retried.
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=self.download_workers) as executor:
+                self.downloads.extend(executor.map(_download, link_tags))
+        except RequestException as ex:
+            raise retry.StepError(retry.Outcome.HTTP_ERROR,
+                                  "Download failed: %s" % ex, State.DOWNLOAD)
 
-        decoded_captcha = captcha.solve(CEJ_CAPTCHA_SCREENSHOT_PATH, self.debug)
-        elm = self.driver.find_element_by_id("codigoCaptcha")
-        elm.send_keys(decoded_captcha)
+        if listing["entries"]:
+            save_listing(listing_path, listing)
+        elif not os.listdir(output_dir):
+            os.rmdir(output_dir)
+        return State.DONE
 
-        elm = self.driver.find_element_by_id("consultarExpedientes")
-        elm.click()
 
-        os.remove(CEJ_FULL_SCREENSHOT_PATH)
-        os.remove(CEJ_CAPTCHA_SCREENSHOT_PATH)
+def get_listing(link_tags):
+    entries = {}
+    for tag in link_tags:
+        # The metadata shown next to the link (acto, fecha, etc.) lives in
+        # the row that contains it.
+        row = tag.find_parent("div") or tag
+        metadata = " ".join(row.get_text(" ").split())
+        entry = "%s\0%s" % (tag.get("href"), metadata)
+        entries[tag.get("href")] = \
+            hashlib.sha1(entry.encode("utf-8")).hexdigest()
 
-        try:
-            selector = "#codCaptchaError, #mensajeNoExisteExpedientes"
-            WebDriverWait(self.driver, 1).until(
-                EC.visibility_of_element_located((By.CSS_SELECTOR, selector)))
-        except TimeoutException:
-            pass
-
-        elm = None
-        for id_ in ("codCaptchaError", "mensajeNoExisteExpedientes"):
-            try:
-                _e = self.driver.find_element_by_id(id_)
-                if _e and _e.is_displayed():
-                    elm = _e
-                    break
-            except NoSuchElementException:
-                pass
-
-        if elm is not None:
-            self.error_message = elm.text.strip()
-            if self.error_message:
-                self.log += "%s\n" % self.error_message
-
-            if "REFRESQUE LA PAGINA" in self.error_message:
-                return retries != 0, True, retries - 1
-
-            if "No se encontraron registros con" in self.error_message:
-                return False, False, retries - 1
-            else:
-                self._log_retries(retries - 1)
-                return self._input_captcha(retries - 1)
+    fingerprint = hashlib.sha1()
+    for href in sorted(entries):
+        fingerprint.update(entries[href].encode("ascii"))
+    return {"fingerprint": fingerprint.hexdigest(), "entries": entries}
 
-        self.error_message = ""
-        return retries != 0, False, retries - 1
-
-    def _click_lupa(self, cod_exp):
-        WebDriverWait(self.driver, 3).until(
-            EC.presence_of_element_located((By.ID, "divDetalles")))
-        main_div = self.driver.find_element_by_id("divDetalles")
-        children_divs = main_div.find_elements_by_xpath("div")
-
-        target_class = None
-        for child_div in children_divs:
-            cod_exp_text = child_div.find_element_by_tag_name("b").text
-            if cod_exp_text == cod_exp:
-                target_class = child_div.get_attribute("class").split()[0]
-                break
 
-        if target_class is None:
-            raise Exception
+def load_listing(path):
+    try:
+        with open(path) as listing_file:
+            return json.load(listing_file)
+    except (OSError, ValueError):
+        return {}
 
-        target_div = \
-            self.driver.find_elements_by_css_selector(".%s" % target_class)[0]
-        target_button = target_div.find_elements_by_tag_name("button")[0]
-        target_button.click()
 
-    def _download_resoluciones(self, output_dir, force):
-        if not force and check_valid_file(output_dir):
-            return
+def save_listing(path, listing):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as listing_file:
+        json.dump(listing, listing_file)
+    os.replace(tmp_path, path)
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
 
-        download_buttons = self.driver.find_elements_by_class_name("aDescarg")
-        for download_button in download_buttons:
-            url = download_button.get_attribute("href")
-            download_with_driver(self.driver, output_dir, url, force)
+# The Selenium scrapers live in pjscrap.browser, so that the HTTP scraper
+# works without Selenium installed.
+_BROWSER_NAMES = ("CejScraper", "CejScraperHybrid")
 
-        if not download_buttons:
-            os.rmdir(output_dir)
 
-        return len(download_buttons)
+def __getattr__(name):
+    if name in _BROWSER_NAMES:
+        from pjscrap import browser
+        return getattr(browser, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import Counter
+from collections import namedtuple
+
+import numpy as np
+
+from pjscrap import captcha
+
+
+# Verdicts for which the server accepted the captcha, so the guess is known
+# to be its answer.
+ACCEPTED_VERDICTS = ("1", "2")
+# The server rejected the answer. Other verdicts ("-CV", "-CM") are about the
+# session and say nothing about the answer.
+REJECTED_VERDICTS = ("-C",)
+
+# "entry_id" is stable across runs and is used to label entries afterwards.
+# "self_labeled" is true when the label is the guess that the server
+# accepted, so such entries only contain captchas that the recording solver
+# already got right.
+CorpusEntry = namedtuple("CorpusEntry",
+                         ["entry_id", "image", "guess", "verdict", "label",
+                          "self_labeled", "time"])
+
+
+class CaptchaCorpus:
+    DATA_FILENAME = "captchas.bin"
+    INDEX_FILENAME = "index.jsonl"
+    # Labels given afterwards, e.g. to rejected captchas, by entry_id.
+    LABELS_FILENAME = "labels.jsonl"
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, self.DATA_FILENAME)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.path, self.INDEX_FILENAME)
+
+    @property
+    def labels_path(self):
+        return os.path.join(self.path, self.LABELS_FILENAME)
+
+    def record(self, image, guess, verdict, label=None):
+        with self._lock:
+            with open(self.data_path, "ab") as data_file:
+                offset = data_file.tell()
+                data_file.write(image)
+
+            entry = {
+                "offset": offset,
+                "length": len(image),
+                "guess": guess,
+                "verdict": verdict,
+                "time": time.time(),
+            }
+            if label is not None:
+                entry["label"] = label
+            with open(self.index_path, "a") as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+
+    def add_label(self, entry_id, label):
+        with self._lock:
+            with open(self.labels_path, "a") as labels_file:
+                labels_file.write(json.dumps({"entry_id": entry_id,
+                                              "label": label}) + "\n")
+
+    def _load_labels(self):
+        labels = {}
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path) as labels_file:
+                for line in labels_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        # The last label given to an entry wins.
+                        labels[entry["entry_id"]] = entry["label"]
+        return labels
+
+    def __iter__(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        labels = self._load_labels()
+        with open(self.index_path) as index_file, \
+                open(self.data_path, "rb") as data_file:
+            for line in index_file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                data_file.seek(entry["offset"])
+                image = data_file.read(entry["length"])
+
+                # The offset in the data file identifies the entry.
+                entry_id = entry["offset"]
+                label = labels.get(entry_id, entry.get("label"))
+                self_labeled = False
+                if label is None and entry["verdict"] in ACCEPTED_VERDICTS:
+                    label = entry["guess"]
+                    self_labeled = True
+                yield CorpusEntry(entry_id, image, entry["guess"],
+                                  entry["verdict"], label, self_labeled,
+                                  entry["time"])
+
+    def labeled(self):
+        return [entry for entry in self if entry.label]
+
+    def unlabeled(self):
+        return [entry for entry in self if not entry.label]
+
+    def verdict_counts(self):
+        return Counter(entry.verdict for entry in self)
+
+
+def first_try_rate(verdict_counts):
+    """Returns the share of submitted answers that the server accepted,
+    leaving out the verdicts that do not depend on the answer."""
+    n_accepted = sum(verdict_counts[v] for v in ACCEPTED_VERDICTS)
+    n_rejected = sum(verdict_counts[v] for v in REJECTED_VERDICTS)
+    if not n_accepted + n_rejected:
+        return float("nan")
+    return n_accepted / (n_accepted + n_rejected)
+
+
+def percentile(values, q):
+    if not len(values):
+        return float("nan")
+    return float(np.percentile(values, q))
+
+
+class Evaluation:
+    def __init__(self):
+        self.n_total = 0
+        self.n_correct = 0
+        self.char_totals = Counter()
+        self.char_errors = Counter()
+        self.latencies = []
+
+    @property
+    def accuracy(self):
+        return self.n_correct / self.n_total if self.n_total else 0.0
+
+    def char_error_rates(self):
+        return {char: self.char_errors[char] / total
+                for char, total in sorted(self.char_totals.items())}
+
+    def add(self, label, answer, latency):
+        self.n_total += 1
+        self.n_correct += answer == label
+        self.latencies.append(latency)
+
+        for i, char in enumerate(label):
+            self.char_totals[char] += 1
+            # A wrong length shifts every character, so all of them count
+            # as errors.
+            if len(answer) != len(label) or answer[i] != char:
+                self.char_errors[char] += 1
+
+
+def evaluate(entries, solve):
+    evaluation = Evaluation()
+    for entry in entries:
+        img = captcha.decode_image(entry.image) \
+            if isinstance(entry.image, bytes) else entry.image
+        start = time.perf_counter()
+        answer = solve(img)
+        evaluation.add(entry.label, answer, time.perf_counter() - start)
+    return evaluation
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+from bs4 import SoupStrainer
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+# Only these parts of the pages are parsed, the rest (head, scripts, menus)
+# is skipped by the tokenizer. The detail page is only strained for
+# metadata: downloads need every aDescarg link, wherever it is.
+SEARCH_STRAINER = SoupStrainer("div", id="divDetalles")
+METADATA_STRAINER = SoupStrainer("div")
+
+# "Fecha de Resolución: 04/02/2020", but not "10:30".
+FIELD_RE = re.compile(r"^([^\W\d][^:]{0,59}):\s*(.*)$")
+
+
+def parse_search(content):
+    return BeautifulSoup(content, HTML_PARSER, parse_only=SEARCH_STRAINER)
+
+
+def parse_detail(content):
+    return BeautifulSoup(content, HTML_PARSER)
+
+
+def parse_metadata(content):
+    return BeautifulSoup(content, HTML_PARSER, parse_only=METADATA_STRAINER)
+
+
+def get_fields(strings):
+    """Collects "label: value" pairs, whether they share a string or the
+    label is in an element of its own followed by the value."""
+    fields = {}
+    label = None
+    for text in strings:
+        text = " ".join(text.split())
+        if not text:
+            continue
+        if label is not None:
+            fields.setdefault(label, text)
+            label = None
+            continue
+
+        match = FIELD_RE.match(text)
+        if match is None:
+            continue
+        name, value = match.group(1).strip(), match.group(2)
+        if value:
+            fields.setdefault(name, value)
+        else:
+            label = name
+    return fields
+
+
+def get_row(link_tag):
+    """Returns the outermost element around a download link that contains
+    no other link, i.e. the block of its resolución."""
+    row = link_tag
+    for parent in link_tag.parents:
+        if parent.parent is None or \
+                len(parent.find_all("a", {"class": "aDescarg"}, limit=2)) > 1:
+            break
+        row = parent
+    return row
+
+
+def get_record(expediente, soup, page_url):
+    """Returns the fields of the case header and, for each resolución, its
+    download URL and the fields shown next to its link."""
+    link_tags = soup.find_all("a", {"class": "aDescarg"})
+    rows = [get_row(tag) for tag in link_tags]
+
+    resoluciones = []
+    for tag, row in zip(link_tags, rows):
+        strings = list(row.stripped_strings)
+        resoluciones.append({
+            "url": urljoin(page_url, tag.get("href")),
+            "fields": get_fields(strings),
+            "text": " ".join(" ".join(strings).split()),
+        })
+
+    header_strings = []
+    first_row = rows[0] if rows else None
+    for string in soup.find_all(string=True):
+        # Tags compare equal by content, rows must be compared by identity.
+        if first_row is not None and \
+                any(parent is first_row for parent in string.parents):
+            break
+        header_strings.append(string)
+    return {
+        "expediente": expediente,
+        "header": {
+            "fields": get_fields(header_strings),
+            "text": " ".join(" ".join(header_strings).split()),
+        },
+        "resoluciones": resoluciones,
+    }
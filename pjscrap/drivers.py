@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+
+
+DEFAULT_MAX_JOBS_PER_DRIVER = 50
+
+
+def firefox_factory(headless):
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+
+    def _factory():
+        options = Options()
+        options.headless = headless
+        return webdriver.Firefox(options=options)
+
+    return _factory
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.n_jobs = 0
+
+
+class DriverPool:
+    def __init__(self, factory, size, reset_url,
+                 max_jobs=DEFAULT_MAX_JOBS_PER_DRIVER):
+        self.factory = factory
+        self.size = size
+        self.reset_url = reset_url
+        self.max_jobs = max_jobs
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            return _PooledDriver(self.factory())
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, pooled, crashed=False):
+        pooled.n_jobs += 1
+        recycle = crashed or self._closed or \
+            (self.max_jobs and pooled.n_jobs >= self.max_jobs)
+
+        if not recycle:
+            try:
+                self._reset(pooled.driver)
+            except Exception:
+                traceback.print_exc()
+                recycle = True
+
+        if recycle:
+            self._discard(pooled)
+        else:
+            self._idle.put(pooled)
+        self._slots.release()
+
+    @contextmanager
+    def borrow(self):
+        pooled = self.acquire()
+        try:
+            yield pooled.driver
+        except Exception:
+            self.release(pooled, crashed=True)
+            raise
+        self.release(pooled)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+    def _reset(self, driver):
+        driver.delete_all_cookies()
+        driver.get(self.reset_url)
+
+    def _discard(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            traceback.print_exc()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import re
+
+
+# expediente-año-incidente-distrito/provincia-órgano-especialidad-instancia,
+# e.g. 00123-2020-0-1801-JR-CI-01.
+CODE_RE = re.compile(r"^(\d{1,5})-(\d{4})-(\d{1,3})-(\d{4})-([A-Z]{2})-"
+                     r"([A-Z]{2})-(\d{1,2})$")
+# Codes are often pasted with spaces, underscores or slashes.
+SEPARATOR_RE = re.compile(r"[\s_/–—-]+")
+
+# Width of every part of a code once packed into an integer.
+_PACKED_BITS = (17, 14, 10, 14, 10, 10, 7)
+
+
+def normalize(code):
+    """Returns the canonical form of a code, as the CEJ form expects it, or
+    raises ValueError if it is not valid."""
+    code = SEPARATOR_RE.sub("-", code.strip().upper()).strip("-")
+    match = CODE_RE.match(code)
+    if match is None:
+        raise ValueError("Invalid expediente code: %r" % code)
+
+    (expediente, anio, incidente, distprov, organo, especialidad,
+     instancia) = match.groups()
+    return "%05d-%s-%d-%s-%s-%s-%02d" % (int(expediente), anio,
+                                         int(incidente), distprov, organo,
+                                         especialidad, int(instancia))
+
+
+def _letters_value(letters):
+    return (ord(letters[0]) - ord("A")) * 26 + ord(letters[1]) - ord("A")
+
+
+def pack(code):
+    """Packs a normalized code losslessly into an 82-bit integer."""
+    parts = code.split("-")
+    values = [int(parts[0]), int(parts[1]), int(parts[2]), int(parts[3]),
+              _letters_value(parts[4]), _letters_value(parts[5]),
+              int(parts[6])]
+    packed = 0
+    for bits, value in zip(_PACKED_BITS, values):
+        packed = (packed << bits) | value
+    return packed
+
+
+class SeenSet:
+    """Set of codes that keeps small integers instead of strings."""
+
+    def __init__(self):
+        self._packed = set()
+
+    def add(self, code):
+        """Adds a normalized code and returns whether it was new."""
+        packed = pack(code)
+        if packed in self._packed:
+            return False
+        self._packed.add(packed)
+        return True
+
+    def __len__(self):
+        return len(self._packed)
+
+
+def parse_shard(text):
+    """Parses "i/N", with 0 <= i < N."""
+    match = re.match(r"^(\d+)/(\d+)$", text.strip())
+    if match is None:
+        raise ValueError("Invalid shard %r, expected i/N" % text)
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index >= count:
+        raise ValueError("Invalid shard %r, expected 0 <= i < N" % text)
+    return index, count
+
+
+def shard_of(code, count):
+    # A stable hash, unlike hash(), so that every node agrees.
+    digest = hashlib.blake2b(code.encode("ascii"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+class CodeStream:
+    """Normalizes, validates, deduplicates and shards codes as they are
+    read, so the input is never loaded as a whole."""
+
+    def __init__(self, lines, shard=None, on_invalid=None):
+        self.lines = lines
+        self.shard = shard
+        self.on_invalid = on_invalid
+        self.seen = SeenSet()
+        self.n_invalid = 0
+        self.n_duplicates = 0
+        self.n_other_shards = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            try:
+                code = normalize(line)
+            except ValueError:
+                self.n_invalid += 1
+                if self.on_invalid is not None:
+                    self.on_invalid(line)
+                continue
+
+            # Sharding first keeps only the codes of this shard in memory.
+            if self.shard is not None:
+                index, count = self.shard
+                if shard_of(code, count) != index:
+                    self.n_other_shards += 1
+                    continue
+
+            if not self.seen.add(code):
+                self.n_duplicates += 1
+                continue
+            yield code
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+from pjscrap import captcha
+
+
+GLYPH_SHAPE = (16, 12)
+GLYPH_SIZE = GLYPH_SHAPE[0] * GLYPH_SHAPE[1]
+MIN_GLYPH_WIDTH = 3
+MIN_GLYPH_PIXELS = 8
+
+
+def _strip_padding(img):
+    # captcha.preprocess surrounds the captcha with a white padding whose
+    # width depends on the profile, so strip every white outer row/column.
+    rows = np.flatnonzero((img != 255).any(axis=1))
+    cols = np.flatnonzero((img != 255).any(axis=0))
+    if not len(rows):
+        return img[:0, :0]
+    return img[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+def _ink_mask(img):
+    img = _strip_padding(img)
+    if not img.size:
+        return np.zeros((0, 0), bool)
+    # The dominant value is the background.
+    background = 255 if np.count_nonzero(img) * 2 > img.size else 0
+    return img != background
+
+
+def _column_runs(columns):
+    padded = np.concatenate(([False], columns, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges.reshape(-1, 2)
+
+
+def segment(img):
+    mask = _ink_mask(img)
+    glyphs = []
+    for start, end in _column_runs(mask.any(axis=0)):
+        if end - start < MIN_GLYPH_WIDTH:
+            continue
+        glyph = mask[:, start:end]
+        rows = np.flatnonzero(glyph.any(axis=1))
+        glyph = glyph[rows[0]:rows[-1] + 1]
+        if np.count_nonzero(glyph) < MIN_GLYPH_PIXELS:
+            continue
+        glyphs.append(_normalize(glyph))
+
+    if not glyphs:
+        return _empty_glyphs()
+    return np.stack(glyphs)
+
+
+def _empty_glyphs():
+    return np.empty((0, GLYPH_SIZE), np.float32)
+
+
+def _normalize(glyph):
+    glyph = glyph.astype(np.float32)
+    glyph = cv2.resize(glyph, GLYPH_SHAPE[::-1], interpolation=cv2.INTER_AREA)
+    return glyph.ravel()
+
+
+class TemplateClassifier:
+    def __init__(self, templates, labels, k=1):
+        self.templates = np.asarray(templates, np.float32)
+        self.labels = np.asarray(labels)
+        self.k = k
+        self._sq_norms = np.einsum("ij,ij->i", self.templates, self.templates)
+
+    @classmethod
+    def fit(cls, glyphs, labels, k=1):
+        return cls(glyphs, labels, k)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["templates"], data["labels"], int(data["k"]))
+
+    def save(self, path):
+        np.savez_compressed(path, templates=self.templates,
+                            labels=self.labels, k=self.k)
+
+    def distances(self, glyphs):
+        sq_norms = np.einsum("ij,ij->i", glyphs, glyphs)
+        dist = sq_norms[:, None] + self._sq_norms[None, :] - \
+            2 * glyphs @ self.templates.T
+        return np.maximum(dist, 0)
+
+    def predict(self, glyphs):
+        if not len(glyphs):
+            return self.labels[:0], np.empty(0, np.float32)
+
+        dist = self.distances(glyphs)
+        if self.k == 1:
+            nearest = dist.argmin(axis=1)
+            return self.labels[nearest], dist[np.arange(len(dist)), nearest]
+
+        nearest = np.argpartition(dist, self.k - 1, axis=1)[:, :self.k]
+        votes = self.labels[nearest]
+        predicted = []
+        for row in votes:
+            values, counts = np.unique(row, return_counts=True)
+            predicted.append(values[counts.argmax()])
+        return np.array(predicted), dist[np.arange(len(dist)),
+                                         nearest[:, 0]]
+
+
+def confidence(distances):
+    if not len(distances):
+        return 0.0
+    # Distances are bounded by GLYPH_SIZE since glyph pixels are in [0, 1].
+    scores = 1 - np.sqrt(distances / GLYPH_SIZE)
+    return float(scores.min())
+
+
+def solve_batch(images, classifier, profile=None):
+    if not len(images):
+        return []
+
+    preprocessed = [captcha.preprocess(img, profile=profile) for img in images]
+    per_image = [segment(img) if img is not None else _empty_glyphs()
+                 for img in preprocessed]
+
+    counts = [len(glyphs) for glyphs in per_image]
+    labels, _ = classifier.predict(np.concatenate(per_image))
+
+    texts = []
+    offset = 0
+    for count in counts:
+        texts.append("".join(labels[offset:offset + count]))
+        offset += count
+    return texts
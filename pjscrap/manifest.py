@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+
+
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_NOT_FOUND = "not_found"
+STATUS_FAILED = "failed"
+
+# Expedientes with these statuses are not scraped again.
+FINISHED_STATUSES = (STATUS_DONE, STATUS_NOT_FOUND)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expedientes (
+    expediente TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error_message TEXT,
+    started_at REAL,
+    finished_at REAL,
+    n_resoluciones INTEGER
+);
+CREATE INDEX IF NOT EXISTS expedientes_status ON expedientes (status);
+CREATE TABLE IF NOT EXISTS files (
+    expediente TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    url TEXT NOT NULL,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (expediente, path)
+);
+"""
+
+
+class RunManifest:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def status(self, expediente):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM expedientes WHERE expediente = ?",
+                (expediente,)).fetchone()
+        return row[0] if row else None
+
+    def is_finished(self, expediente):
+        return self.status(expediente) in FINISHED_STATUSES
+
+    def start(self, expediente):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO expedientes "
+                "(expediente, status, attempts, started_at) "
+                "VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (expediente) DO UPDATE SET "
+                "status = excluded.status, attempts = attempts + 1, "
+                "started_at = excluded.started_at, finished_at = NULL, "
+                "error_message = NULL",
+                (expediente, STATUS_RUNNING, time.time()))
+
+    def finish(self, expediente, status, error_message=None,
+               n_resoluciones=None, downloads=()):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "UPDATE expedientes SET status = ?, error_message = ?, "
+                    "finished_at = ?, n_resoluciones = ? "
+                    "WHERE expediente = ?",
+                    (status, error_message or None, now, n_resoluciones,
+                     expediente))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO files "
+                    "(expediente, path, size, sha256, url, downloaded_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(expediente, download.path, download.size,
+                      download.sha256, download.url, now)
+                     for download in downloads
+                     # Skipped files keep the row of their download.
+                     if download.sha256 is not None])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def unfinished(self):
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT expediente FROM expedientes "
+                "WHERE status NOT IN (%s) ORDER BY expediente" % placeholders,
+                FINISHED_STATUSES).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
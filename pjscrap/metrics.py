@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+STAGE_CAPTCHA_FETCH = "captcha_fetch"
+STAGE_CAPTCHA_SOLVE = "captcha_solve"
+STAGE_VALIDATE = "validate"
+STAGE_SEARCH = "search"
+STAGE_DETAIL = "detail"
+STAGE_DOWNLOAD = "download"
+STAGE_EXPEDIENTE = "expediente"
+
+OUTCOME_OK = "ok"
+OUTCOME_ERROR = "error"
+
+# Upper bounds in seconds of the histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0, 30.0, 60.0)
+DEFAULT_TEXTFILE_INTERVAL = 15.0
+
+# Messages have no stage, timed events no message.
+Event = namedtuple("Event", ["time", "stage", "duration", "outcome", "bytes",
+                             "message"])
+
+
+def http_outcome(response):
+    if response.status_code < 400:
+        return OUTCOME_OK
+    return "http_%d" % response.status_code
+
+
+class Span:
+    def __init__(self):
+        self.outcome = OUTCOME_OK
+        self.bytes = 0
+
+
+class EventBuffer:
+    """Events of a single expediente, forwarded to the recorder of the run.
+    """
+
+    def __init__(self, expediente=None, recorder=None, clock=time.time):
+        self.expediente = expediente
+        self.recorder = recorder
+        self.clock = clock
+        self.events = []
+
+    def clear(self):
+        self.events = []
+
+    def log(self, message):
+        self.events.append(Event(self.clock(), None, None, None, None,
+                                 message.rstrip("\n")))
+
+    def add(self, stage, duration, outcome=OUTCOME_OK, n_bytes=0):
+        event = Event(self.clock(), stage, duration, outcome, n_bytes, None)
+        # list.append is atomic, so the threads downloading the files of an
+        # expediente can share the buffer.
+        self.events.append(event)
+        if self.recorder is not None:
+            self.recorder.record(self.expediente, event)
+        return event
+
+    @contextmanager
+    def timed(self, stage):
+        span = Span()
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            if span.outcome == OUTCOME_OK:
+                span.outcome = OUTCOME_ERROR
+            raise
+        finally:
+            self.add(stage, time.perf_counter() - start, span.outcome,
+                     span.bytes)
+
+    def format(self):
+        lines = []
+        for event in self.events:
+            if event.stage is None:
+                lines.append(event.message)
+            else:
+                line = "%s %s %.1f ms" % (event.stage, event.outcome,
+                                          1000 * event.duration)
+                if event.bytes:
+                    line += " %d bytes" % event.bytes
+                lines.append(line)
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class MetricsRecorder:
+    """Aggregates the events of every scraper and optionally streams them
+    to a JSONL file."""
+
+    def __init__(self, jsonl_path=None, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._jsonl_file = None
+        if jsonl_path:
+            self._jsonl_file = open(jsonl_path, "a", buffering=1)
+        self.counts = Counter()
+        self.duration_sums = defaultdict(float)
+        self.bucket_counts = defaultdict(lambda: [0] * len(self.buckets))
+        self.bytes = Counter()
+
+    def record(self, expediente, event):
+        with self._lock:
+            key = (event.stage, event.outcome)
+            self.counts[key] += 1
+            self.duration_sums[key] += event.duration
+            self.bytes[event.stage] += event.bytes
+            bucket_counts = self.bucket_counts[key]
+            for i, bound in enumerate(self.buckets):
+                if event.duration <= bound:
+                    bucket_counts[i] += 1
+                    break
+
+            if self._jsonl_file is not None:
+                self._jsonl_file.write(json.dumps({
+                    "time": event.time,
+                    "expediente": expediente,
+                    "stage": event.stage,
+                    "outcome": event.outcome,
+                    "duration": event.duration,
+                    "bytes": event.bytes,
+                }) + "\n")
+
+    def to_prometheus(self):
+        with self._lock:
+            keys = sorted(self.counts)
+            lines = [
+                "# HELP pjscrap_stage_duration_seconds Duration of each "
+                "stage of the scraping.",
+                "# TYPE pjscrap_stage_duration_seconds histogram",
+            ]
+            for stage, outcome in keys:
+                labels = 'stage="%s",outcome="%s"' % (stage, outcome)
+                cumulative = 0
+                for bound, n in zip(self.buckets,
+                                    self.bucket_counts[stage, outcome]):
+                    cumulative += n
+                    lines.append(
+                        'pjscrap_stage_duration_seconds_bucket{%s,le="%g"} %d'
+                        % (labels, bound, cumulative))
+                lines.append(
+                    'pjscrap_stage_duration_seconds_bucket{%s,le="+Inf"} %d'
+                    % (labels, self.counts[stage, outcome]))
+                lines.append("pjscrap_stage_duration_seconds_sum{%s} %f" %
+                             (labels, self.duration_sums[stage, outcome]))
+                lines.append("pjscrap_stage_duration_seconds_count{%s} %d" %
+                             (labels, self.counts[stage, outcome]))
+
+            lines.append("# HELP pjscrap_stage_bytes_total Bytes "
+                         "transferred by each stage.")
+            lines.append("# TYPE pjscrap_stage_bytes_total counter")
+            for stage in sorted(self.bytes):
+                lines.append('pjscrap_stage_bytes_total{stage="%s"} %d' %
+                             (stage, self.bytes[stage]))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        # The textfile collector of node_exporter may read it at any time.
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as textfile:
+            textfile.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def close(self):
+        with self._lock:
+            if self._jsonl_file is not None:
+                self._jsonl_file.close()
+                self._jsonl_file = None
+
+
+class TextfileWriter:
+    """Writes the snapshot of a recorder every `interval` seconds."""
+
+    def __init__(self, recorder, path, interval=DEFAULT_TEXTFILE_INTERVAL):
+        self.recorder = recorder
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.recorder.write_textfile(self.path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        # The last snapshot covers the whole run.
+        self.recorder.write_textfile(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import io
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+
+import requests
+from PIL import Image
+
+from pjscrap import captcha
+from pjscrap import metrics
+from pjscrap import throttle as throttling
+
+
+# Seconds a solved captcha is considered valid by the server.
+DEFAULT_MAX_AGE = 60
+# Seconds get() waits for a captcha before giving up.
+DEFAULT_GET_TIMEOUT = 30
+
+PrefetchedCaptcha = namedtuple("PrefetchedCaptcha",
+                               ["cookies", "image", "solution", "fetched_at"])
+
+
+class PrefetchError(Exception):
+    pass
+
+
+class CaptchaPrefetcher:
+    def __init__(self, captcha_url, solver=captcha.solve_detailed, size=2,
+                 n_threads=1, max_age=DEFAULT_MAX_AGE, debug=False,
+                 throttle=None, recorder=None):
+        self.captcha_url = captcha_url
+        self.solver = solver
+        self.throttle = throttle or throttling.UNLIMITED
+        self.recorder = recorder
+        self.max_age = max_age
+        self.debug = debug
+        self.n_fetched = 0
+        self.n_expired = 0
+        self.last_error = None
+        self._ready = queue.Queue(maxsize=size)
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(n_threads)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def get(self, timeout=DEFAULT_GET_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            # Wakes up every second to notice dead threads.
+            wait = min(1.0, deadline - time.monotonic())
+            try:
+                prefetched = self._ready.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if not any(thread.is_alive() for thread in self._threads):
+                    raise PrefetchError("The prefetch threads are not "
+                                        "running")
+                if time.monotonic() >= deadline:
+                    raise PrefetchError("No captcha prefetched in %gs. "
+                                        "Last error: %r" %
+                                        (timeout, self.last_error))
+                continue
+            if time.monotonic() - prefetched.fetched_at <= self.max_age:
+                return prefetched
+            self.n_expired += 1
+
+    def _work(self):
+        # A captcha belongs to the JSESSIONID it was served with, so cookies
+        # are cleared before every fetch to get a new session while the
+        # connection pool is kept.
+        session = requests.Session()
+        # The fetches belong to no expediente yet, but still feed the stage
+        # metrics of the run.
+        events = metrics.EventBuffer(recorder=self.recorder)
+        while not self._stopped.is_set():
+            session.cookies.clear()
+            events.clear()
+            try:
+                with events.timed(metrics.STAGE_CAPTCHA_FETCH) as span, \
+                        self.throttle.slot(throttling.KIND_CAPTCHA) as ticket:
+                    res = session.get(self.captcha_url)
+                    ticket.observe(res)
+                    span.outcome = metrics.http_outcome(res)
+                    span.bytes = len(res.content)
+                fetched_at = time.monotonic()
+                img = Image.open(io.BytesIO(res.content))
+                with events.timed(metrics.STAGE_CAPTCHA_SOLVE):
+                    solution = self.solver(img, self.debug)
+            except Exception as ex:
+                # Any error of the solver (missing engine, dead process
+                # pool, etc.) too, so that the thread keeps running and get()
+                # can report it.
+                self.last_error = ex
+                traceback.print_exc()
+                self._stopped.wait(1)
+                continue
+
+            prefetched = PrefetchedCaptcha(session.cookies.copy(),
+                                           res.content, solution, fetched_at)
+            self.n_fetched += 1
+            while not self._stopped.is_set():
+                try:
+                    self._ready.put(prefetched, timeout=0.5)
+                    break
+                except queue.Full:
+                    pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+import traceback
+from collections import Counter
+from collections import namedtuple
+from enum import auto
+from enum import Enum
+
+
+class Outcome(Enum):
+    # The server rejected the answer of the captcha ("-C").
+    WRONG_CAPTCHA = auto()
+    # The captcha expired or the server asks for a reload ("-CV", "-CM").
+    EXPIRED_CAPTCHA = auto()
+    # A search on a reused session did not list the expediente.
+    SESSION_REJECTED = auto()
+    HTTP_ERROR = auto()
+    BROWSER_ERROR = auto()
+    PARSE_ERROR = auto()
+    # "No se encontraron registros" ("2").
+    NOT_FOUND = auto()
+    ERROR = auto()
+
+
+RetryPolicy = namedtuple("RetryPolicy",
+                         ["max_retries", "base_delay", "max_delay"])
+
+DEFAULT_POLICIES = {
+    Outcome.WRONG_CAPTCHA: RetryPolicy(10, 0.1, 2.0),
+    Outcome.EXPIRED_CAPTCHA: RetryPolicy(5, 0.5, 10.0),
+    Outcome.SESSION_REJECTED: RetryPolicy(1, 0.0, 0.0),
+    Outcome.HTTP_ERROR: RetryPolicy(5, 0.5, 30.0),
+    Outcome.BROWSER_ERROR: RetryPolicy(3, 1.0, 30.0),
+    Outcome.PARSE_ERROR: RetryPolicy(3, 0.5, 10.0),
+    Outcome.NOT_FOUND: RetryPolicy(0, 0.0, 0.0),
+    Outcome.ERROR: RetryPolicy(3, 1.0, 30.0),
+}
+
+Transition = namedtuple("Transition", ["time", "state", "outcome", "attempt",
+                                       "delay", "message"])
+
+
+class StepError(Exception):
+    """Raised by a step with the outcome that made it fail and the state
+    to resume from if the outcome may be retried."""
+
+    def __init__(self, outcome, message, retry_state):
+        super().__init__(message)
+        self.outcome = outcome
+        self.message = message
+        self.retry_state = retry_state
+
+
+def backoff_delay(policy, attempt, rng=random):
+    # "Full jitter": concurrent scrapers failing together spread their
+    # retries over the whole window instead of retrying in lockstep.
+    ceiling = min(policy.max_delay, policy.base_delay * 2 ** attempt)
+    return rng.uniform(0, ceiling)
+
+
+class RetryBudget:
+    def __init__(self, retries, policies=None, rng=random):
+        self.retries = retries
+        # Outcomes are not strings, so they cannot be keyword arguments.
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.rng = rng
+        self.attempts = Counter()
+
+    def next_delay(self, outcome):
+        """Consumes a retry for the outcome and returns the delay before
+        it, or None if the outcome or the whole budget is exhausted."""
+        policy = self.policies[outcome]
+        if self.retries <= 0 or self.attempts[outcome] >= policy.max_retries:
+            return None
+        delay = backoff_delay(policy, self.attempts[outcome], self.rng)
+        self.attempts[outcome] += 1
+        self.retries -= 1
+        return delay
+
+
+class StateMachine:
+    """Runs the step of each state until one without step is reached.
+
+    A step returns the next state or raises StepError; any other exception
+    is an ERROR outcome that resumes from `restart_state`.
+    """
+
+    def __init__(self, steps, budget, restart_state, failed_state,
+                 sleep=time.sleep, clock=time.time):
+        self.steps = steps
+        self.budget = budget
+        self.restart_state = restart_state
+        self.failed_state = failed_state
+        self.sleep = sleep
+        self.clock = clock
+        self.transitions = []
+        self.error = None
+
+    def _record(self, state, outcome=None, attempt=0, delay=0.0,
+                message=None):
+        self.transitions.append(Transition(self.clock(), state, outcome,
+                                           attempt, delay, message))
+
+    def run(self, state):
+        self.error = None
+        self._record(state)
+        while state in self.steps:
+            try:
+                state = self.steps[state]()
+            except StepError as ex:
+                error = ex
+            except Exception:
+                error = StepError(Outcome.ERROR, traceback.format_exc(),
+                                  self.restart_state)
+            else:
+                self._record(state)
+                continue
+
+            self.error = error
+            delay = self.budget.next_delay(error.outcome)
+            if delay is None:
+                state = self.failed_state
+                self._record(state, error.outcome,
+                             self.budget.attempts[error.outcome], 0.0,
+                             error.message)
+                break
+
+            state = error.retry_state
+            self._record(state, error.outcome,
+                         self.budget.attempts[error.outcome], delay,
+                         error.message)
+            self.sleep(delay)
+        else:
+            self.error = None
+        return state
+
+
+def format_transitions(transitions):
+    if not transitions:
+        return ""
+
+    start = transitions[0].time
+    lines = []
+    for i, transition in enumerate(transitions):
+        line = "+%.3fs %s" % (transition.time - start, transition.state.name)
+        if transition.outcome is None:
+            pass
+        elif i == len(transitions) - 1:
+            line += " after %s (no retries left)" % transition.outcome.name
+        else:
+            line += " after %s (retry %d, waited %.2fs)" % \
+                (transition.outcome.name, transition.attempt,
+                 transition.delay)
+        lines.append(line)
+        if transition.message:
+            lines.append(transition.message.rstrip())
+    return "\n".join(lines) + "\n"
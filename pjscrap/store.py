@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+from collections import namedtuple
+
+
+LINK_HARDLINK = "hardlink"
+LINK_MANIFEST = "manifest"
+LINK_MODES = (LINK_HARDLINK, LINK_MANIFEST)
+# Written in each expediente directory in manifest mode.
+MANIFEST_FILENAME = ".objects.json"
+INDEX_FILENAME = "index.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+StoredFile = namedtuple("StoredFile", ["digest", "filename", "size"])
+
+
+class ContentStore:
+    """Keeps a single copy of each resolución under its sha256, however
+    many expedientes it belongs to.
+
+    Expediente directories get a hardlink to the object or, in manifest
+    mode, an entry in their MANIFEST_FILENAME. Files are always downloaded,
+    as the content behind a URL may change, and deduplicated by digest; the
+    index also records the object last served by each URL.
+    """
+
+    def __init__(self, root, link_mode=LINK_HARDLINK):
+        if link_mode not in LINK_MODES:
+            raise ValueError("Unknown link mode: %r" % link_mode)
+        self.root = root
+        self.link_mode = link_mode
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, INDEX_FILENAME),
+                                     timeout=60, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest[2:])
+
+    def add(self, path, digest, size, url, filename):
+        """Moves a downloaded file into the store, or deletes it if the
+        store already has its content."""
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            os.remove(path)
+            self._count("deduplicated", size)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # The download directory may be on another filesystem.
+            shutil.move(path, object_path)
+            self._count("stored", size)
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO objects (digest, size, stored_at) "
+                    "VALUES (?, ?, ?)", (digest, size, time.time()))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO urls (url, digest, filename, size) "
+                    "VALUES (?, ?, ?, ?)", (url, digest, filename, size))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return StoredFile(digest, filename, size)
+
+    def link(self, stored, output_dir):
+        """Makes the object appear in the expediente directory and returns
+        the path of the file, which in manifest mode is the object itself."""
+        if self.link_mode == LINK_MANIFEST:
+            self._add_to_manifest(output_dir, stored)
+            return self.object_path(stored.digest)
+
+        output_filename = os.path.join(output_dir, stored.filename)
+        object_path = self.object_path(stored.digest)
+        # Renaming a link over another link of the same object does nothing.
+        if os.path.exists(output_filename) and \
+                os.path.samefile(output_filename, object_path):
+            return output_filename
+
+        # Hidden, so that a link left by a crash is not taken for a
+        # resolución.
+        tmp_filename = os.path.join(output_dir, ".%s.link" % stored.filename)
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        try:
+            os.link(object_path, tmp_filename)
+        except OSError:
+            # Another filesystem, or too many links to the object.
+            shutil.copyfile(object_path, tmp_filename)
+            self._count("copied", stored.size)
+        os.replace(tmp_filename, output_filename)
+        return output_filename
+
+    def _add_to_manifest(self, output_dir, stored):
+        path = os.path.join(output_dir, MANIFEST_FILENAME)
+        # The files of an expediente are downloaded concurrently.
+        with self._lock:
+            manifest = load_manifest(output_dir)
+            manifest[stored.filename] = {"digest": stored.digest,
+                                         "size": stored.size}
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+            os.replace(tmp_path, path)
+
+    def _count(self, key, size):
+        with self._lock:
+            self.counts[key] += 1
+            self.counts[key + "_bytes"] += size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from requests.exceptions import HTTPError
+from requests.exceptions import RequestException
+
+
+KIND_CAPTCHA = "captcha"
+KIND_SEARCH = "search"
+KIND_DOWNLOAD = "download"
+
+LimiterConfig = namedtuple("LimiterConfig",
+                           ["concurrency", "max_concurrency", "rate",
+                            "max_rate"])
+
+DEFAULT_LIMITS = {
+    KIND_CAPTCHA: LimiterConfig(4, 32, 10.0, 100.0),
+    KIND_SEARCH: LimiterConfig(4, 32, 20.0, 200.0),
+    KIND_DOWNLOAD: LimiterConfig(8, 64, 40.0, 400.0),
+}
+
+MIN_CONCURRENCY = 1
+MIN_RATE = 1.0
+# Factors applied to the limits when the server returns errors, and when
+# it only slows down: queueing is an earlier and milder sign of overload.
+DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.8
+# Requests per second added to the rate for every window of successes.
+RATE_STEP = 2.0
+# The server is overloaded when the smoothed share of 5xx responses,
+# connection errors, etc. goes above this. Isolated errors are not enough.
+ERROR_RATE_THRESHOLD = 0.1
+ERROR_RATE_ALPHA = 0.05
+# ... or when the recent latency is this many times the long-term one.
+LATENCY_TOLERANCE = 3.0
+LATENCY_ALPHA = 0.2
+BASELINE_ALPHA = 0.01
+
+LimiterStats = namedtuple("LimiterStats",
+                          ["concurrency", "rate", "in_flight", "latency",
+                           "error_rate", "n_requests", "n_overloaded",
+                           "n_decreases"])
+
+
+class Ticket:
+    def __init__(self, start):
+        self.start = start
+        self.latency = None
+        self.overloaded = False
+
+    def observe(self, response):
+        # Time until the headers arrived, which does not depend on the size
+        # of streamed bodies.
+        self.latency = response.elapsed.total_seconds()
+        if response.status_code >= 500 or response.status_code == 429:
+            self.overloaded = True
+
+
+class AimdLimiter:
+    """Limits the requests in flight and their rate, with additive increase
+    while the server is healthy and multiplicative decrease when it is not.
+    """
+
+    def __init__(self, concurrency=4, max_concurrency=32, rate=10.0,
+                 max_rate=100.0, clock=time.monotonic):
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.rate = float(rate)
+        self.max_rate = max_rate
+        self.clock = clock
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.error_rate = 0.0
+        self.slow_start = True
+        self.n_requests = 0
+        self.n_overloaded = 0
+        self.n_decreases = 0
+        self._cond = threading.Condition()
+        self._tokens = 1.0
+        self._last_refill = clock()
+        self._last_decrease = float("-inf")
+
+    def _refill(self, now):
+        burst = max(1.0, self.concurrency)
+        self._tokens = min(burst, self._tokens +
+                           (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = self.clock()
+                self._refill(now)
+                if self.in_flight < int(self.concurrency):
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self.in_flight += 1
+                        return Ticket(now)
+                    timeout = (1.0 - self._tokens) / self.rate
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+
+    def release(self, ticket):
+        now = self.clock()
+        latency = ticket.latency
+        if latency is None:
+            latency = now - ticket.start
+
+        with self._cond:
+            self.in_flight -= 1
+            self.n_requests += 1
+            self.error_rate += ERROR_RATE_ALPHA * \
+                (ticket.overloaded - self.error_rate)
+            if ticket.overloaded:
+                self.n_overloaded += 1
+            else:
+                self._observe_latency(latency)
+
+            slow = self.latency is not None and \
+                self.latency > LATENCY_TOLERANCE * self.baseline_latency
+            failing = self.error_rate > ERROR_RATE_THRESHOLD
+            # Requests sent before the last decrease reflect the old limits,
+            # so a burst of failures only decreases them once.
+            if (failing or slow) and ticket.start >= self._last_decrease:
+                self._decrease(now, DECREASE_FACTOR if failing
+                               else LATENCY_DECREASE_FACTOR)
+            elif not (failing or slow or ticket.overloaded):
+                self._increase()
+            self._cond.notify_all()
+
+    def _observe_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+            if self.baseline_latency is None:
+                self.baseline_latency = latency
+            return
+        self.latency += LATENCY_ALPHA * (latency - self.latency)
+        self.baseline_latency += BASELINE_ALPHA * \
+            (latency - self.baseline_latency)
+
+    def _decrease(self, now, factor):
+        self.concurrency = max(MIN_CONCURRENCY, self.concurrency * factor)
+        self.rate = max(MIN_RATE, self.rate * factor)
+        # The signals start over under the new limits.
+        self.error_rate = 0.0
+        self.latency = None
+        self.slow_start = False
+        self._last_decrease = now
+        self.n_decreases += 1
+
+    def _increase(self):
+        # Spread over a window of successes, as many as the limit itself.
+        # Until the first sign of overload the limits double every window,
+        # like the slow start of TCP, instead of growing linearly.
+        window = max(1.0, self.concurrency)
+        if self.slow_start:
+            concurrency_step, rate_step = 1.0, self.rate / window
+        else:
+            concurrency_step, rate_step = 1.0 / window, RATE_STEP / window
+        self.concurrency = min(self.max_concurrency,
+                               self.concurrency + concurrency_step)
+        self.rate = min(self.max_rate, self.rate + rate_step)
+
+    def stats(self):
+        with self._cond:
+            return LimiterStats(self.concurrency, self.rate, self.in_flight,
+                                self.latency, self.error_rate,
+                                self.n_requests, self.n_overloaded,
+                                self.n_decreases)
+
+
+class Throttle:
+    """Shared by every scraper, so that the limits apply to the whole run.
+    Kinds without a limiter are not throttled."""
+
+    def __init__(self, limits=DEFAULT_LIMITS):
+        self.limiters = {kind: AimdLimiter(*config)
+                         for kind, config in limits.items()}
+
+    @contextmanager
+    def slot(self, kind):
+        limiter = self.limiters.get(kind)
+        ticket = limiter.acquire() if limiter is not None else Ticket(None)
+        try:
+            yield ticket
+        except HTTPError as ex:
+            if ex.response is not None:
+                ticket.observe(ex.response)
+            raise
+        except RequestException:
+            # Connection errors and timeouts.
+            ticket.overloaded = True
+            raise
+        finally:
+            if limiter is not None:
+                limiter.release(ticket)
+
+    def stats(self):
+        return {kind: limiter.stats()
+                for kind, limiter in self.limiters.items()}
+
+
+UNLIMITED = Throttle({})
@@ -1,20 +1,44 @@
 # -*- coding: utf-8 -*-
 import cgi
+import hashlib
 import os
+from collections import namedtuple
 
-import magic
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
 
+from pjscrap import metrics
+from pjscrap import throttle as throttling
+from pjscrap import validation
 
-DEFAULT_DOWNLOAD_CHUNK_SIZE = 2048
+
+DEFAULT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DEFAULT_POOL_SIZE = 10
+PARTIAL_SUFFIX = validation.PARTIAL_SUFFIX
+
+Download = namedtuple("Download", ["path", "size", "sha256", "url"])
 
 
 def get_request_session(driver):
     session = requests.Session()
+    copy_driver_cookies(driver, session)
+    return session
+
+
+def copy_driver_cookies(driver, session):
+    """Replaces the cookies of the session, e.g. a pooled one, with those of
+    the browser."""
+    session.cookies.clear()
     for cookie in driver.get_cookies():
         session.cookies.set(cookie['name'], cookie['value'])
 
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
     return session
 
 
@@ -30,40 +54,87 @@ def setup_ssl():
 
 
 def download_with_session(session, output_dir, url, force,
-                          chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE):
+                          chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE,
+                          validator=validation.check_file, throttle=None,
+                          events=None, store=None):
+    # The slot is held for the whole transfer, so the limit of the throttle
+    # bounds the bodies being streamed too.
+    throttle = throttle or throttling.UNLIMITED
+    events = events or metrics.EventBuffer()
+    with events.timed(metrics.STAGE_DOWNLOAD) as span, \
+            throttle.slot(throttling.KIND_DOWNLOAD) as ticket:
+        return _download(session, output_dir, url, force, chunk_size,
+                         validator, ticket, span, store)
+
+
+def _download(session, output_dir, url, force, chunk_size, validator,
+              ticket, span, store):
     r = session.get(url, stream=True)
+    ticket.observe(r)
+    span.outcome = metrics.http_outcome(r)
+    r.raise_for_status()
 
     _, params = cgi.parse_header(r.headers["Content-disposition"])
     output_filename = os.path.join(output_dir, params["filename"])
 
-    with open(output_filename, "wb") as f:
+    if not force and validator(output_filename):
+        # Only the headers were read, the body is never transferred.
+        r.close()
+        span.outcome = "skipped"
+        return Download(output_filename, os.path.getsize(output_filename),
+                        None, url)
+
+    # The file is written under a temporary name and renamed once complete,
+    # so an interrupted download never looks like a finished one.
+    partial_filename = output_filename + PARTIAL_SUFFIX
+    offset = 0
+    if not force and os.path.exists(partial_filename):
+        offset = os.path.getsize(partial_filename)
+
+    if offset:
+        r.close()
+        r = session.get(url, stream=True,
+                        headers={"Range": "bytes=%d-" % offset})
+        ticket.observe(r)
+        span.outcome = metrics.http_outcome(r)
+        content_range = r.headers.get("Content-Range", "")
+        if r.status_code != 206 or \
+                not content_range.startswith("bytes %d-" % offset):
+            offset = 0
+    r.raise_for_status()
+
+    digest = hashlib.sha256()
+    if offset:
+        with open(partial_filename, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+
+    size = offset
+    with open(partial_filename, "ab" if offset else "wb") as f:
         for chunk in r.iter_content(chunk_size):
             f.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+            span.bytes += len(chunk)
+
+    if store is not None:
+        stored = store.add(partial_filename, digest.hexdigest(), size, url,
+                           params["filename"])
+        output_filename = store.link(stored, output_dir)
+    else:
+        os.replace(partial_filename, output_filename)
+
+    return Download(output_filename, size, digest.hexdigest(), url)
 
 
 def download_with_driver(driver, output_dir, url, force,
-                         chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE):
+                         chunk_size=DEFAULT_DOWNLOAD_CHUNK_SIZE,
+                         validator=validation.check_file, events=None,
+                         store=None):
     session = get_request_session(driver)
-    download_with_session(session, output_dir, url, force, chunk_size)
+    return download_with_session(session, output_dir, url, force, chunk_size,
+                                 validator, events=events, store=store)
 
 
 def check_valid_file(path):
-    if not os.path.exists(path) or not os.path.isfile(path):
-        return False
-
-    mime = magic.Magic(mime=True)
-    mimetype = mime.from_file(path)
-    if mimetype == "application/pdf":
-        import PyPDF2
-        with open(path, "rb") as f:
-            try:
-                PyPDF2.PdfFileReader(f)
-            except PyPDF2.utils.PdfReadError:
-                return False
-    elif mimetype == "application/msword":
-        import docx
-        try:
-            docx.Document(path)
-        except docx.opc.exceptions.PackageNotFoundError:
-            return False
-    return True
+    return validation.check_file(path, deep=True)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
+
+PDF_MAGIC = b"%PDF-"
+PDF_EOF = b"%%EOF"
+ZIP_MAGIC = b"PK\x03\x04"
+ZIP_END_OF_CENTRAL_DIR = b"PK\x05\x06"
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# The end of central directory record is 22 bytes long and may be followed
+# by a comment of up to 64 KiB.
+ZIP_TAIL_SIZE = 22 + 0xffff
+PDF_TAIL_SIZE = 1024
+OLE_SECTOR_SIZE = 512
+
+TYPE_PDF = "application/pdf"
+TYPE_ZIP = "application/zip"
+TYPE_MSWORD = "application/msword"
+
+DEFAULT_WORKERS = 8
+# Appended to the files being downloaded, which are resumed with a Range
+# request and must not be validated or deleted.
+PARTIAL_SUFFIX = ".part"
+
+
+def sniff_type(head):
+    if head.startswith(PDF_MAGIC):
+        return TYPE_PDF
+    if head.startswith(ZIP_MAGIC):
+        return TYPE_ZIP
+    if head.startswith(OLE_MAGIC):
+        return TYPE_MSWORD
+    return None
+
+
+def _read_tail(f, size, tail_size):
+    f.seek(max(0, size - tail_size))
+    return f.read()
+
+
+def _check_structure(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        filetype = sniff_type(f.read(len(OLE_MAGIC)))
+        if filetype == TYPE_PDF:
+            return filetype, PDF_EOF in _read_tail(f, size, PDF_TAIL_SIZE)
+        if filetype == TYPE_ZIP:
+            tail = _read_tail(f, size, ZIP_TAIL_SIZE)
+            return filetype, ZIP_END_OF_CENTRAL_DIR in tail
+        if filetype == TYPE_MSWORD:
+            return filetype, size > OLE_SECTOR_SIZE
+    return filetype, True
+
+
+def _check_deeply(path, filetype):
+    # Truncated or garbage files make the parsers fail in many ways
+    # (ValueError, struct.error, BadZipFile, ...): any of them means the
+    # file is invalid, and must not abort the whole validation run.
+    try:
+        if filetype == TYPE_PDF:
+            import PyPDF2
+            with open(path, "rb") as f:
+                PyPDF2.PdfFileReader(f)
+        elif filetype == TYPE_ZIP:
+            import docx
+            docx.Document(path)
+    except ImportError:
+        raise
+    except Exception:
+        return False
+    return True
+
+
+def check_file(path, deep=False):
+    if not os.path.isfile(path):
+        return False
+
+    filetype, valid = _check_structure(path)
+    if valid and deep:
+        valid = _check_deeply(path, filetype)
+    return valid
+
+
+class ValidationCache:
+    def __init__(self, path, deep=False):
+        self.path = path
+        self.deep = deep
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS validations ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, deep INTEGER NOT NULL, "
+            "valid INTEGER NOT NULL)")
+
+    def lookup(self, path, deep=None):
+        deep = self.deep if deep is None else deep
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, deep, valid FROM validations "
+                "WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+
+        size, mtime_ns, cached_deep, valid = row
+        if (size, mtime_ns) != (st.st_size, st.st_mtime_ns):
+            return None
+        # A deep validation also answers structural ones, and a file that
+        # is structurally broken can not pass a deep validation.
+        if deep and not cached_deep and valid:
+            return None
+        return bool(valid)
+
+    def store(self, path, valid, deep=None):
+        deep = self.deep if deep is None else deep
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO validations "
+                "(path, size, mtime_ns, deep, valid) VALUES (?, ?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, int(deep), int(valid)))
+
+    def check(self, path, deep=None):
+        deep = self.deep if deep is None else deep
+        valid = self.lookup(path, deep)
+        if valid is None:
+            valid = check_file(path, deep)
+            self.store(path, valid, deep)
+        return valid
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def iter_files(root):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            # Hidden files hold scraper state, not resoluciones.
+            if filename.startswith(".") or filename.endswith(PARTIAL_SUFFIX):
+                continue
+            yield os.path.join(dirpath, filename)
+
+
+def validate_dir(root, deep=False, cache=None, workers=DEFAULT_WORKERS):
+    results = {}
+    pending = []
+    for path in iter_files(root):
+        valid = cache.lookup(path, deep) if cache is not None else None
+        if valid is None:
+            pending.append(path)
+        else:
+            results[path] = valid
+
+    # Deep validation parses the documents, so it runs in processes to use
+    # every CPU; the structural one only reads a few bytes per file.
+    executor_class = ProcessPoolExecutor if deep else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        checked = executor.map(check_file, pending, [deep] * len(pending),
+                               chunksize=64 if deep else 1)
+        for path, valid in zip(pending, checked):
+            results[path] = valid
+            if cache is not None:
+                cache.store(path, valid, deep)
+
+    return results
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+STATUS_NOT_FOUND = "not_found"
+STATUS_FAILED = "failed"
+
+STATUSES = (STATUS_PENDING, STATUS_LEASED, STATUS_DONE, STATUS_NOT_FOUND,
+            STATUS_FAILED)
+
+DEFAULT_LEASE_TIMEOUT = 300.0
+# Leases taken by a worker that keeps crashing on an expediente.
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 5.0
+# Finished expedientes counted by the throughput of stats().
+THROUGHPUT_WINDOW = 300.0
+ENQUEUE_CHUNK_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    expediente TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    enqueued_at REAL NOT NULL,
+    leased_at REAL,
+    lease_expires REAL,
+    heartbeat_at REAL,
+    finished_at REAL,
+    error_message TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, enqueued_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+QueueStats = namedtuple("QueueStats",
+                        ["counts", "n_owners", "oldest_lease_age",
+                         "oldest_heartbeat_age", "n_expired", "throughput"])
+
+
+def default_owner():
+    """Identifies a worker process across the nodes sharing a queue."""
+    return "%s:%d:%s" % (socket.gethostname(), os.getpid(),
+                         uuid.uuid4().hex[:8])
+
+
+class WorkQueue:
+    """Queue of expedientes shared by any number of processes and nodes.
+
+    Workers lease one expediente at a time. A lease that is not renewed
+    by a heartbeat within `lease_timeout` seconds is taken over by the
+    next worker asking for work, so the expedientes of a crashed worker
+    are not lost. The write lock of SQLite serializes the leases.
+
+    On a network filesystem pass `shared_fs=True`: WAL needs memory shared
+    by every process, which only exists on a single host.
+    """
+
+    def __init__(self, path, lease_timeout=DEFAULT_LEASE_TIMEOUT,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, shared_fs=False,
+                 clock=time.time):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=%s" %
+                           ("DELETE" if shared_fs else "WAL"))
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def enqueue(self, expedientes):
+        """Adds the expedientes not queued yet and returns how many."""
+        n_added = 0
+        chunk = []
+        for expediente in expedientes:
+            chunk.append(expediente)
+            if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+                n_added += self._enqueue_chunk(chunk)
+                chunk = []
+        if chunk:
+            n_added += self._enqueue_chunk(chunk)
+        return n_added
+
+    def _enqueue_chunk(self, chunk):
+        now = self.clock()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO jobs "
+                    "(expediente, status, enqueued_at) VALUES (?, ?, ?)",
+                    [(expediente, STATUS_PENDING, now)
+                     for expediente in chunk])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def lease(self, owner):
+        """Leases the oldest pending expediente, or one whose lease
+        expired, and returns it, or None if there is none."""
+        now = self.clock()
+        with self._lock:
+            # The write lock is taken before reading the candidate, so no
+            # other worker can lease it in between. UPDATE ... RETURNING
+            # would need SQLite 3.35.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # The worker holding it crashed on it every time.
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, owner = NULL, "
+                    "finished_at = ?, "
+                    "error_message = 'Lease expired ' || attempts || ' times' "
+                    "WHERE status = ? AND lease_expires < ? "
+                    "AND attempts >= ?",
+                    (STATUS_FAILED, now, STATUS_LEASED, now,
+                     self.max_attempts))
+                row = self._conn.execute(
+                    "SELECT expediente FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY status = ?, enqueued_at LIMIT 1",
+                    (STATUS_PENDING, STATUS_LEASED, now,
+                     STATUS_LEASED)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, owner = ?, "
+                        "attempts = attempts + 1, leased_at = ?, "
+                        "heartbeat_at = ?, lease_expires = ? "
+                        "WHERE expediente = ?",
+                        (STATUS_LEASED, owner, now, now,
+                         now + self.lease_timeout, row[0]))
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return row[0] if row else None
+
+    def heartbeat(self, owner):
+        """Renews every lease of the owner and returns how many."""
+        now = self.clock()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ?, lease_expires = ? "
+                "WHERE owner = ? AND status = ?",
+                (now, now + self.lease_timeout, owner,
+                 STATUS_LEASED)).rowcount
+
+    def finish(self, expediente, owner, status, error_message=None):
+        """Marks a leased expediente as finished. Failed ones go back to
+        the queue until they use up their attempts.
+
+        Returns False if the lease was lost, i.e. it expired and another
+        worker took the expediente over.
+        """
+        now = self.clock()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET "
+                "status = CASE WHEN ? = ? AND attempts < ? THEN ? ELSE ? END, "
+                "owner = NULL, finished_at = ?, error_message = ? "
+                "WHERE expediente = ? AND owner = ? AND status = ?",
+                (status, STATUS_FAILED, self.max_attempts, STATUS_PENDING,
+                 status, now, error_message or None, expediente, owner,
+                 STATUS_LEASED)).rowcount > 0
+
+    def release(self, owner):
+        """Returns the leases of a worker that stops before finishing
+        them, without counting them as attempts."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, owner = NULL, "
+                "attempts = attempts - 1 WHERE owner = ? AND status = ?",
+                (STATUS_PENDING, owner, STATUS_LEASED)).rowcount
+
+    def requeue_failed(self):
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, finished_at = NULL "
+                "WHERE status = ?",
+                (STATUS_PENDING, STATUS_FAILED)).rowcount
+
+    def has_work(self):
+        """Whether expedientes are pending or still leased, possibly by
+        workers that will crash and leave them to be reclaimed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1",
+                (STATUS_PENDING, STATUS_LEASED)).fetchone()
+        return row is not None
+
+    def stats(self, window=THROUGHPUT_WINDOW):
+        now = self.clock()
+        with self._lock:
+            counts = dict.fromkeys(STATUSES, 0)
+            counts.update(self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+            n_owners, oldest_leased_at, oldest_heartbeat_at, n_expired = \
+                self._conn.execute(
+                    "SELECT COUNT(DISTINCT owner), MIN(leased_at), "
+                    "MIN(heartbeat_at), "
+                    "COALESCE(SUM(lease_expires < ?), 0) "
+                    "FROM jobs WHERE status = ?",
+                    (now, STATUS_LEASED)).fetchone()
+            n_recent, = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE finished_at >= ? "
+                "AND status IN (?, ?, ?)",
+                (now - window, STATUS_DONE, STATUS_NOT_FOUND,
+                 STATUS_FAILED)).fetchone()
+        return QueueStats(
+            counts, n_owners,
+            now - oldest_leased_at if oldest_leased_at is not None else None,
+            now - oldest_heartbeat_at
+            if oldest_heartbeat_at is not None else None,
+            n_expired, n_recent / window)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def leased(queue, owner, poll_interval=DEFAULT_POLL_INTERVAL,
+           sleep=time.sleep):
+    """Yields the expedientes leased by the owner until the queue has no
+    work left.
+
+    While other workers hold the last leases it keeps polling, and takes
+    them over if they expire.
+    """
+    while True:
+        expediente = queue.lease(owner)
+        if expediente is not None:
+            yield expediente
+        elif queue.has_work():
+            sleep(poll_interval)
+        else:
+            return
+
+
+class Heartbeat:
+    """Renews the leases of an owner every third of the lease timeout."""
+
+    def __init__(self, queue, owner, interval=None):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval or queue.lease_timeout / 3
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.queue.heartbeat(self.owner)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import argparse
+import functools
+import sys
+import time
+
+
+def probe_backend(captcha, backend_name, img):
+    """Returns why the backend cannot solve captchas here, or None. Some
+    engines are only found missing on the first solve."""
+    try:
+        captcha.solve(img, backend=captcha.get_backend(backend_name))
+    except Exception as ex:
+        return "%s: %s" % (type(ex).__name__, ex)
+    return None
+
+
+def benchmark_backend(captcha, backend_name, images, repeat):
+    backend = captcha.get_backend(backend_name)
+    # Warm up so that engine initialization is not part of the measure.
+    captcha.solve(images[0], backend=backend)
+
+    n_solves = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for img in images:
+            captcha.solve(img, backend=backend)
+            n_solves += 1
+    elapsed = time.perf_counter() - start
+
+    return n_solves, elapsed
+
+
+def benchmark_batch(captcha, backend_name, images, repeat):
+    backend = captcha.get_backend(backend_name)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        captcha.solve_batch(images, backend=backend)
+    elapsed = time.perf_counter() - start
+
+    return repeat * len(images), elapsed
+
+
+def print_result(name, n_solves, elapsed):
+    print("%-18s %6d solves in %7.3fs: %8.2f solves/s, %7.3f ms/solve" %
+          (name, n_solves, elapsed, n_solves / elapsed,
+           1000 * elapsed / n_solves))
+
+
+def print_verdicts(counts):
+    # What the server said about the answers submitted while recording, i.e.
+    # how often the solver was right on the first try.
+    n_total = sum(counts.values())
+    print("Recorded submits: %d. %s" %
+          (n_total, ", ".join("%s: %d (%.1f%%)" %
+                              (verdict, n, 100 * n / n_total)
+                              for verdict, n in counts.most_common())))
+    print("First-try acceptance by the server: %.2f%% (without -CV/-CM)" %
+          (100 * corpus.first_try_rate(counts)))
+
+
+def print_evaluation(name, evaluation):
+    print("%-26s accuracy: %6.2f%% (%d/%d). Latency p50: %.3f ms, "
+          "p99: %.3f ms" %
+          (name, 100 * evaluation.accuracy, evaluation.n_correct,
+           evaluation.n_total,
+           1000 * corpus.percentile(evaluation.latencies, 50),
+           1000 * corpus.percentile(evaluation.latencies, 99)))
+
+    rates = evaluation.char_error_rates()
+    worst = sorted(rates.items(), key=lambda item: -item[1])
+    print("%-26s char error rates: %s" %
+          ("", ", ".join("%s=%.1f%%" % (char, 100 * rate)
+                         for char, rate in worst if rate)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("images",
+                        nargs="*",
+                        help="Captcha images used as speed benchmark input")
+    parser.add_argument("-c", "--corpus",
+                        help="Captcha corpus recorded by cej_download.py "
+                             "with --record-captchas; reports the verdicts "
+                             "of the server and the accuracy on labeled "
+                             "captchas (see captcha_label.py)",
+                        required=False)
+    parser.add_argument("-b", "--backend",
+                        action="append",
+                        help="Backend to measure, can be given several times "
+                             "(defaults to every known backend)",
+                        required=False)
+    parser.add_argument("-n", "--repeat",
+                        type=int,
+                        default=10,
+                        help="Times every image is solved",
+                        required=False)
+
+    args = parser.parse_args()
+
+    if not args.images and not args.corpus:
+        parser.error("either images or --corpus are required")
+
+    import cv2
+    from pjscrap import captcha
+    from pjscrap import corpus
+
+    images = [cv2.imread(path) for path in args.images]
+    entries = []
+    if args.corpus:
+        captcha_corpus = corpus.CaptchaCorpus(args.corpus)
+        verdict_counts = captcha_corpus.verdict_counts()
+        if not verdict_counts:
+            sys.exit("The corpus is empty")
+        print_verdicts(verdict_counts)
+        entries = captcha_corpus.labeled()
+    # Self-labeled captchas were all solved right by the recording solver,
+    # so replaying it on them says nothing about its accuracy.
+    label_groups = [
+        ("labeled", [entry for entry in entries if not entry.self_labeled]),
+        ("self-labeled",
+         [entry for entry in entries if entry.self_labeled]),
+    ]
+    backends = args.backend or list(captcha.BACKENDS)
+
+    if images:
+        probe_img = images[0]
+    else:
+        probe_img = captcha.decode_image(next(iter(captcha_corpus)).image)
+
+    for backend_name in backends:
+        error = probe_backend(captcha, backend_name, probe_img)
+        if error is not None:
+            print("%-18s unavailable: %s" % (backend_name, error))
+            continue
+
+        if images:
+            n_solves, elapsed = \
+                benchmark_backend(captcha, backend_name, images, args.repeat)
+            print_result(backend_name, n_solves, elapsed)
+
+            if hasattr(captcha.get_backend(backend_name), "solve_batch"):
+                n_solves, elapsed = \
+                    benchmark_batch(captcha, backend_name, images,
+                                    args.repeat)
+                print_result("%s (batch)" % backend_name, n_solves, elapsed)
+
+        solve = functools.partial(captcha.solve, backend=backend_name)
+        for group_name, group in label_groups:
+            if group:
+                print_evaluation("%s (%s)" % (backend_name, group_name),
+                                 corpus.evaluate(group, solve))
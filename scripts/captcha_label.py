@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import sys
+
+
+def parse_labeled_path(path):
+    # Exported images are named after their entry ("123456.jpg") and are
+    # labeled by prepending the answer, as captcha_train.py expects:
+    # "A1B2_123456.jpg".
+    name = os.path.splitext(os.path.basename(path))[0]
+    label, _, entry_id = name.rpartition("_")
+    if not label or not entry_id.isdigit():
+        return None, None
+    return int(entry_id), label.split("_")[0].upper()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Labels the captchas of a corpus recorded with "
+                    "cej_download.py --record-captchas, e.g. those the "
+                    "server rejected, so that captcha_benchmark.py measures "
+                    "the accuracy on them too")
+
+    parser.add_argument("corpus",
+                        help="Captcha corpus directory")
+    parser.add_argument("-e", "--export",
+                        help="Writes the unlabeled captchas to this "
+                             "directory as <entry>.jpg",
+                        required=False)
+    parser.add_argument("-i", "--import",
+                        dest="labeled",
+                        nargs="+",
+                        help="Exported images renamed to "
+                             "<ANSWER>_<entry>.jpg",
+                        required=False)
+
+    args = parser.parse_args()
+
+    if not args.export and not args.labeled:
+        parser.error("either --export or --import is required")
+
+    from pjscrap.corpus import CaptchaCorpus
+
+    captcha_corpus = CaptchaCorpus(args.corpus)
+
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+        n_exported = 0
+        for entry in captcha_corpus.unlabeled():
+            path = os.path.join(args.export, "%d.jpg" % entry.entry_id)
+            with open(path, "wb") as image_file:
+                image_file.write(entry.image)
+            n_exported += 1
+        print("Exported %d unlabeled captchas to %s" %
+              (n_exported, args.export))
+
+    if args.labeled:
+        entry_ids = {entry.entry_id for entry in captcha_corpus}
+        n_labeled = 0
+        for path in args.labeled:
+            entry_id, label = parse_labeled_path(path)
+            if entry_id is None:
+                print("Skipping %s: not named <ANSWER>_<entry>" % path,
+                      file=sys.stderr)
+                continue
+            if entry_id not in entry_ids:
+                print("Skipping %s: not an entry of the corpus" % path,
+                      file=sys.stderr)
+                continue
+            captcha_corpus.add_label(entry_id, label)
+            n_labeled += 1
+        print("Labeled %d captchas" % n_labeled)
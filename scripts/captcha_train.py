@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+
+def label_from_path(path):
+    # Labeled captchas are named after their answer, optionally followed by
+    # an underscore and a suffix to keep names unique: "A1B2_003.png".
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name.split("_")[0].upper()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("images",
+                        nargs="+",
+                        help="Captcha images named after their answer")
+    parser.add_argument("-o", "--output",
+                        help="Output model path (.npz)",
+                        required=True)
+    parser.add_argument("-k",
+                        type=int,
+                        default=1,
+                        help="Number of neighbours used to classify a glyph",
+                        required=False)
+
+    args = parser.parse_args()
+
+    from pjscrap import captcha
+    from pjscrap import glyphs
+
+    all_glyphs = []
+    all_labels = []
+    n_skipped = 0
+    for path in args.images:
+        label = label_from_path(path)
+        img = captcha.preprocess(cv2.imread(path))
+        if img is None:
+            n_skipped += 1
+            continue
+
+        segments = glyphs.segment(img)
+        if len(segments) != len(label):
+            n_skipped += 1
+            continue
+
+        all_glyphs.append(segments)
+        all_labels.extend(label)
+
+    if not all_glyphs:
+        sys.exit("No captcha could be segmented")
+
+    classifier = glyphs.TemplateClassifier.fit(np.concatenate(all_glyphs),
+                                               all_labels, args.k)
+    classifier.save(args.output)
+
+    print("Trained with %d glyphs from %d captchas (%d skipped)" %
+          (len(all_labels), len(all_glyphs), n_skipped))
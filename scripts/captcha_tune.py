@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import argparse
+import itertools
+import os
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def load_labeled(args):
+    labeled = []
+    if args.corpus:
+        for entry in corpus.CaptchaCorpus(args.corpus).labeled():
+            labeled.append((captcha.decode_image(entry.image), entry.label))
+    for path in args.images:
+        name = os.path.splitext(os.path.basename(path))[0]
+        labeled.append((cv2.imread(path), name.split("_")[0].upper()))
+    return [(img, label) for img, label in labeled if img is not None]
+
+
+def group_by_shape(labeled):
+    # Captchas of the same size are stacked so that a profile preprocesses
+    # the whole group in a single vectorized pass.
+    groups = defaultdict(lambda: ([], []))
+    for img, label in labeled:
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        grays, labels = groups[gray.shape]
+        grays.append(gray)
+        labels.append(label)
+    return [(np.stack(grays), labels) for grays, labels in groups.values()]
+
+
+def evaluate_profile(profile, groups, backend_name):
+    backend = captcha.get_backend(backend_name, profile.oem)
+    n_total = n_correct = 0
+    start = time.perf_counter()
+    for grays, labels in groups:
+        for img, label in zip(captcha.preprocess_batch(grays, profile),
+                              labels):
+            text, _ = backend.recognize(img)
+            n_correct += text.upper().strip() == label
+            n_total += 1
+    elapsed = time.perf_counter() - start
+    return n_correct / n_total, n_total / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("images",
+                        nargs="*",
+                        help="Captcha images named after their answer")
+    parser.add_argument("-c", "--corpus",
+                        help="Captcha corpus recorded with --record-captchas",
+                        required=False)
+    parser.add_argument("-b", "--backend",
+                        default=None,
+                        help="Backend used to evaluate the profiles",
+                        required=False)
+    parser.add_argument("--name",
+                        default="tuned",
+                        help="Name of the emitted profile",
+                        required=False)
+    parser.add_argument("-o", "--output",
+                        help="Path where the best profile is written (.json)",
+                        required=True)
+    parser.add_argument("--crop-left",
+                        type=int_list,
+                        default=[0, 5, 10, 15],
+                        required=False)
+    parser.add_argument("--threshold",
+                        type=int_list,
+                        default=list(range(110, 200, 10)),
+                        required=False)
+    parser.add_argument("--kernel-size",
+                        type=int_list,
+                        default=[2, 3, 4, 5],
+                        required=False)
+    parser.add_argument("--padding",
+                        type=int_list,
+                        default=[5, 10, 15],
+                        required=False)
+    parser.add_argument("--oem",
+                        type=int_list,
+                        default=[2],
+                        required=False)
+    parser.add_argument("--top",
+                        type=int,
+                        default=10,
+                        help="Number of profiles shown in the report",
+                        required=False)
+
+    args = parser.parse_args()
+
+    if not args.images and not args.corpus:
+        parser.error("either images or --corpus are required")
+
+    from pjscrap import captcha
+    from pjscrap import corpus
+
+    labeled = load_labeled(args)
+    if not labeled:
+        sys.exit("No labeled captchas found")
+    groups = group_by_shape(labeled)
+
+    default = captcha.DEFAULT_PROFILE
+    default_result = evaluate_profile(default, groups, args.backend)
+
+    results = []
+    grid = itertools.product(args.crop_left, args.threshold,
+                             args.kernel_size, args.padding, args.oem)
+    for crop_left, threshold, kernel_size, padding, oem in grid:
+        profile = captcha.Profile(args.name, crop_left, threshold,
+                                  kernel_size, padding, oem)
+        results.append((evaluate_profile(profile, groups, args.backend),
+                        profile))
+
+    results.sort(key=lambda result: result[0], reverse=True)
+    (best_accuracy, best_speed), best = results[0]
+    captcha.save_profile(best, args.output)
+
+    row_tmpl = "%-8s %5s %9s %6s %7s %3s %9s %10s"
+    print("Evaluated %d profiles on %d captchas" %
+          (len(results), len(labeled)))
+    print(row_tmpl % ("profile", "crop", "threshold", "kernel", "padding",
+                      "oem", "accuracy", "solves/s"))
+    shown = [(default_result, default)] + results[:args.top]
+    for (accuracy, speed), profile in shown:
+        print(row_tmpl % (profile.name if profile is default else "",
+                          profile.crop_left, profile.threshold,
+                          profile.kernel_size, profile.padding, profile.oem,
+                          "%.2f%%" % (100 * accuracy), "%.2f" % speed))
+
+    print("Best profile written to %s: accuracy %+.2f points, %.2fx speed "
+          "compared to the default profile" %
+          (args.output, 100 * (best_accuracy - default_result[0]),
+           best_speed / default_result[1]))
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+STAGES = {
+    "Captcha.jpg": "captcha",
+    "ValidarFiltrosCodigo.htm": "validate",
+    "busquedacodform.html": "search",
+    "detalleform.html": "detail",
+    "documentoD.html": "download",
+}
+
+
+class StageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.n_requests = 0
+
+    def add(self, stage, latency):
+        with self._lock:
+            self.latencies[stage].append(latency)
+            if stage != "solve":
+                self.n_requests += 1
+
+    def response_hook(self, response, *args, **kwargs):
+        name = os.path.basename(urlsplit(response.url).path)
+        # Time until the response headers arrived; the body of downloads is
+        # streamed afterwards.
+        self.add(STAGES.get(name, name), response.elapsed.total_seconds())
+
+    def timed_solver(self, solver):
+        def _solve(img, show_process=False):
+            start = time.perf_counter()
+            try:
+                return solver(img, show_process)
+            finally:
+                self.add("solve", time.perf_counter() - start)
+        return _solve
+
+
+def generate_expedientes(n, not_found_ratio):
+    n_not_found = int(n * not_found_ratio)
+    for i in range(n):
+        # Spread the missing codes evenly, as they appear in real inputs.
+        not_found = (i + 1) * n_not_found // n > i * n_not_found // n
+        suffix = standin.NOT_FOUND_SUFFIX if not_found else \
+            "-%02d" % (i % 99 + 1)
+        yield "%05d-2020-0-1801-JR-CI%s" % (i, suffix)
+
+
+def oracle_solver(img, show_process=False):
+    # Used with a stand-in that accepts any answer, so that the benchmark
+    # does not depend on the OCR backend.
+    return captcha.Solution("A" * 4, 1.0, 4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--expedientes",
+                        type=int,
+                        default=100,
+                        required=False)
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=4,
+                        required=False)
+    parser.add_argument("-r", "--retries",
+                        type=int,
+                        default=10,
+                        required=False)
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0.05,
+                        help="Server latency per request in seconds",
+                        required=False)
+    parser.add_argument("--latency-jitter",
+                        type=float,
+                        default=0.02,
+                        required=False)
+    parser.add_argument("--rate-cv",
+                        type=float,
+                        default=0.0,
+                        required=False)
+    parser.add_argument("--rate-cm",
+                        type=float,
+                        default=0.02,
+                        required=False)
+    parser.add_argument("--rate-c",
+                        type=float,
+                        default=0.0,
+                        help="Share of right captcha answers rejected with "
+                             "-C anyway",
+                        required=False)
+    parser.add_argument("--rate-5xx",
+                        type=float,
+                        default=0.01,
+                        required=False)
+    parser.add_argument("--capacity",
+                        type=int,
+                        default=0,
+                        help="Requests in flight beyond which the stand-in "
+                             "slows down and fails more (0 for no limit)",
+                        required=False)
+    parser.add_argument("--file-size",
+                        type=int,
+                        default=64 * 1024,
+                        required=False)
+    parser.add_argument("--max-resoluciones",
+                        type=int,
+                        default=10,
+                        required=False)
+    parser.add_argument("--not-found-ratio",
+                        type=float,
+                        default=0.1,
+                        required=False)
+    parser.add_argument("--oracle",
+                        action="store_true",
+                        help="Accept any captcha answer instead of running "
+                             "the OCR",
+                        required=False)
+    parser.add_argument("--reuse-session",
+                        action="store_true",
+                        help="Search further expedientes with an already "
+                             "validated captcha",
+                        required=False)
+    parser.add_argument("--max-searches-per-captcha",
+                        type=int,
+                        default=0,
+                        help="Searches the stand-in allows per validated "
+                             "captcha (0 for no limit)",
+                        required=False)
+    parser.add_argument("--throttle",
+                        action="store_true",
+                        help="Share an adaptive throttle between the "
+                             "scrapers",
+                        required=False)
+    parser.add_argument("--captcha-backend",
+                        default=None,
+                        required=False)
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0,
+                        required=False)
+
+    args = parser.parse_args()
+
+    from pjscrap import captcha
+    from pjscrap import corpus
+    from pjscrap.cej import CaptchaSession
+    from pjscrap.cej import CejScraperSimple
+    from pjscrap.throttle import Throttle
+    from pjscrap.utils import create_session
+    from scripts import standin
+
+    config = standin.StandinConfig(
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        rate_cv=args.rate_cv, rate_cm=args.rate_cm, rate_c=args.rate_c,
+        rate_5xx=args.rate_5xx,
+        file_size=args.file_size, max_resoluciones=args.max_resoluciones,
+        accept_any_captcha=args.oracle,
+        max_searches_per_captcha=args.max_searches_per_captcha,
+        capacity=args.capacity,
+        seed=args.seed)
+
+    stats = StageStats()
+    if args.oracle:
+        solver = stats.timed_solver(oracle_solver)
+    else:
+        backend = captcha.get_backend(args.captcha_backend)
+
+        def solver(img, show_process=False):
+            return captcha.solve_detailed(img, show_process, backend)
+
+        solver = stats.timed_solver(solver)
+
+    output_dir = tempfile.mkdtemp(prefix="pjscrap-bench-")
+    outcomes = defaultdict(int)
+    outcomes_lock = threading.Lock()
+    throttle = Throttle() if args.throttle else None
+    captcha_sessions = []
+    local = threading.local()
+
+    def _get_captcha_session():
+        captcha_session = getattr(local, "captcha_session", None)
+        if captcha_session is None or not args.reuse_session:
+            session = create_session()
+            session.hooks["response"].append(stats.response_hook)
+            captcha_session = CaptchaSession(session)
+            local.captcha_session = captcha_session
+            with outcomes_lock:
+                captcha_sessions.append(captcha_session)
+        return captcha_session
+
+    def _scrape(expediente, base_url):
+        captcha_session = _get_captcha_session()
+        cej_scraper = CejScraperSimple(captcha_session.session, expediente,
+                                       False, solver, base_url=base_url,
+                                       captcha_session=captcha_session,
+                                       throttle=throttle)
+        try:
+            cej_scraper.run(os.path.join(output_dir, expediente), False,
+                            args.retries)
+            outcome = "error" if cej_scraper.error_message else "success"
+            if "No se encontraron registros" in cej_scraper.error_message:
+                outcome = "not found"
+        except Exception:
+            outcome = "exception"
+        with outcomes_lock:
+            outcomes[outcome] += 1
+
+    try:
+        with standin.StandinServer(config) as server:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                for expediente in generate_expedientes(args.expedientes,
+                                                       args.not_found_ratio):
+                    executor.submit(_scrape, expediente, server.base_url)
+            elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    print("Expedientes: %d in %.2fs (%.2f expedientes/s) with %d workers" %
+          (args.expedientes, elapsed, args.expedientes / elapsed,
+           args.workers))
+    print("Outcomes: %s" % ", ".join("%s=%d" % item
+                                     for item in sorted(outcomes.items())))
+    print("Requests per expediente: %.2f" %
+          (stats.n_requests / args.expedientes))
+    coverage = [n for captcha_session in captcha_sessions
+                for n in captcha_session.coverage]
+    if coverage:
+        print("Validated captchas: %d (%.2f expedientes per captcha)" %
+              (len(coverage), sum(coverage) / len(coverage)))
+    if throttle is not None:
+        for kind, limiter_stats in sorted(throttle.stats().items()):
+            print("Throttle %s: concurrency %.1f, rate %.1f/s, "
+                  "overloaded %d/%d" %
+                  (kind, limiter_stats.concurrency, limiter_stats.rate,
+                   limiter_stats.n_overloaded, limiter_stats.n_requests))
+    print("%-10s %8s %10s %10s %10s" % ("stage", "count", "p50 ms",
+                                        "p90 ms", "p99 ms"))
+    for stage in ("captcha", "solve", "validate", "search", "detail",
+                  "download"):
+        latencies = stats.latencies.get(stage, [])
+        print("%-10s %8d %10.2f %10.2f %10.2f" %
+              (stage, len(latencies),
+               1000 * corpus.percentile(latencies, 50),
+               1000 * corpus.percentile(latencies, 90),
+               1000 * corpus.percentile(latencies, 99)))
@@ -1,13 +1,23 @@
 # -*- coding: utf-8 -*-
 import argparse
+import functools
+import json
 import os
 import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 
-import requests
+
+print_lock = threading.Lock()
+totals = Counter()
 
 
 def print_skip_summary(expediente, output_file=sys.stderr):
-    print("Expediente: %s. Skip.", file=output_file)
+    print("Expediente: %s. Skip." % expediente, file=output_file)
 
 
 def print_error_summary(expediente, cej_scraper, retries, n_downloads,
@@ -17,12 +27,275 @@ def print_error_summary(expediente, cej_scraper, retries, n_downloads,
         msg %= (expediente, retries, cej_scraper.error_message)
     else:
         msg = "Expediente: %s. Retries: %d. Success. Downloads: %d"
-        msg %= (expediente, retries, n_downloads)
+        msg %= (expediente, retries, n_downloads or 0)
+
+    n_new_resoluciones = getattr(cej_scraper, "n_new_resoluciones", None)
+    if n_new_resoluciones is not None:
+        msg += ". New or changed: %d" % n_new_resoluciones
+
+    n_avoided_submits = getattr(cej_scraper, "n_avoided_submits", 0)
+    if n_avoided_submits:
+        msg += ". Avoided captcha submits: %d" % n_avoided_submits
+
+    if getattr(cej_scraper, "reused_captcha", False):
+        msg += ". Reused captcha"
 
     print(msg, file=output_file)
 
 
+def print_throttle_stats(throttle, output_file=sys.stderr):
+    for kind, stats in sorted(throttle.stats().items()):
+        print("Throttle %s: concurrency %.1f, rate %.1f/s, latency %s, "
+              "overloaded %d/%d, decreases %d" %
+              (kind, stats.concurrency, stats.rate,
+               "%.0f ms" % (1000 * stats.latency)
+               if stats.latency is not None else "-",
+               stats.n_overloaded, stats.n_requests, stats.n_decreases),
+              file=output_file)
+
+
+def print_totals(coverage=None, output_file=sys.stderr):
+    print("Expedientes: %d. Skipped: %d. Avoided captcha submits: %d" %
+          (totals["expedientes"], totals["skipped"],
+           totals["avoided_submits"]),
+          file=output_file)
+    if coverage:
+        print("Validated captchas: %d. Expedientes per captcha: "
+              "mean %.2f, max %d" %
+              (len(coverage), sum(coverage) / len(coverage), max(coverage)),
+              file=output_file)
+
+
+def print_store_stats(store, output_file=sys.stderr):
+    counts = store.counts
+    print("Store: %d files stored (%.1f MB). Deduplicated downloads: %d "
+          "(%.1f MB). Copied instead of linked: %d" %
+          (counts["stored"], counts["stored_bytes"] / 1e6,
+           counts["deduplicated"], counts["deduplicated_bytes"] / 1e6,
+           counts["copied"]), file=output_file)
+
+
+def print_invalid_code(line, output_file=sys.stderr):
+    with print_lock:
+        print("Invalid expediente code: %s. Skip." % line, file=output_file)
+
+
+def print_lost_lease(expediente, output_file=sys.stderr):
+    with print_lock:
+        print("Expediente: %s. Lease lost: it expired and another worker "
+              "took it over" % expediente, file=output_file)
+
+
+def print_queue_summary(n_added, code_stream, output_file=sys.stderr):
+    print("Queued: %d new of %d expedientes" %
+          (n_added, len(code_stream.seen)), file=output_file)
+
+
+def print_input_summary(code_stream, output_file=sys.stderr):
+    print("Input: %d expedientes. Invalid: %d. Duplicates: %d. "
+          "Other shards: %d" %
+          (len(code_stream.seen), code_stream.n_invalid,
+           code_stream.n_duplicates, code_stream.n_other_shards),
+          file=output_file)
+
+
+class Batch:
+    def __init__(self, args, solver, driver_pool=None, corpus=None,
+                 prefetcher=None, manifest=None, validator=None,
+                 throttle=None, recorder=None, queue=None, owner=None,
+                 store=None, records_file=None):
+        self.args = args
+        self.solver = solver
+        self.driver_pool = driver_pool
+        self.corpus = corpus
+        self.prefetcher = prefetcher
+        self.manifest = manifest
+        self.validator = validator
+        self.throttle = throttle
+        self.recorder = recorder
+        self.queue = queue
+        self.owner = owner
+        self.store = store
+        self.records_file = records_file
+        self.captcha_sessions = []
+        self._captcha_sessions_lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_captcha_session(self):
+        # Each worker keeps its own session, so that the captcha it
+        # validated is used for the following expedientes.
+        captcha_session = getattr(self._local, "captcha_session", None)
+        if captcha_session is None:
+            session = create_session(max(self.args.download_workers,
+                                         DEFAULT_POOL_SIZE))
+            captcha_session = CaptchaSession(session)
+            self._local.captcha_session = captcha_session
+            with self._captcha_sessions_lock:
+                self.captcha_sessions.append(captcha_session)
+        return captcha_session
+
+    def captcha_coverage(self):
+        with self._captcha_sessions_lock:
+            return [n for captcha_session in self.captcha_sessions
+                    for n in captcha_session.coverage]
+
+    def create_scraper(self, expediente):
+        args = self.args
+        if args.use_selenium:
+            return CejScraper(self.driver_pool, args.debug, self.solver,
+                              self.validator, args.base_url,
+                              recorder=self.recorder, store=self.store,
+                              metadata_only=args.metadata_only)
+
+        captcha_session = None
+        if args.reuse_session:
+            captcha_session = self.get_captcha_session()
+            session = captcha_session.session
+        else:
+            session = create_session(max(args.download_workers,
+                                         DEFAULT_POOL_SIZE))
+        if args.hybrid:
+            return CejScraperHybrid(self.driver_pool, session, expediente,
+                                    args.debug, self.solver, self.validator,
+                                    args.download_workers, args.incremental,
+                                    args.base_url, captcha_session,
+                                    throttle=self.throttle,
+                                    recorder=self.recorder, store=self.store,
+                                    metadata_only=args.metadata_only)
+        solution_filter = captcha.SolutionFilter(args.captcha_length,
+                                                 args.captcha_min_confidence,
+                                                 args.captcha_max_refetch)
+        return CejScraperSimple(session, expediente, args.debug, self.solver,
+                                solution_filter, self.corpus, self.prefetcher,
+                                self.validator, args.download_workers,
+                                args.incremental, args.base_url,
+                                captcha_session, throttle=self.throttle,
+                                recorder=self.recorder, store=self.store,
+                                metadata_only=args.metadata_only)
+
+    def should_skip(self, expediente, output_dir):
+        if self.manifest is not None and not self.args.force:
+            return self.manifest.is_finished(expediente)
+        return self.args.skip_existing_dir and os.path.exists(output_dir)
+
+    def finish_lease(self, expediente, status, error_message=None):
+        if self.queue is None:
+            return
+        if not self.queue.finish(expediente, self.owner, status,
+                                 error_message):
+            print_lost_lease(expediente)
+
+    def process(self, expediente):
+        args = self.args
+        output_dir = os.path.abspath(os.path.join(args.output, expediente))
+        log_path = None
+        if args.log_dir:
+            log_path = os.path.join(args.log_dir, "%s.log" % expediente)
+
+        if self.should_skip(expediente, output_dir):
+            with print_lock:
+                totals["skipped"] += 1
+                if not args.silent:
+                    print_skip_summary(expediente)
+            if log_path:
+                with open(log_path, "w") as log_file:
+                    print_skip_summary(expediente, log_file)
+            self.finish_lease(expediente, STATUS_DONE)
+            return
+
+        cej_scraper = self.create_scraper(expediente)
+        if self.manifest is not None:
+            self.manifest.start(expediente)
+
+        start = time.perf_counter()
+        try:
+            if args.use_selenium:
+                _, _, retries, n_downloads =\
+                    cej_scraper.run(expediente, output_dir, args.force,
+                                    args.retries)
+            else:
+                _, _, retries, n_downloads =\
+                    cej_scraper.run(output_dir, args.force, args.retries)
+        except Exception as ex:
+            if self.manifest is not None:
+                self.manifest.finish(expediente, STATUS_FAILED, str(ex))
+            self.finish_lease(expediente, STATUS_FAILED, str(ex))
+            raise
+
+        status = get_status(cej_scraper)
+        if self.manifest is not None:
+            self.manifest.finish(expediente, status,
+                                 cej_scraper.error_message, n_downloads,
+                                 cej_scraper.downloads)
+        self.finish_lease(expediente, status, cej_scraper.error_message)
+        cej_scraper.events.add(STAGE_EXPEDIENTE,
+                               time.perf_counter() - start, status)
+
+        with print_lock:
+            if self.records_file is not None and cej_scraper.record:
+                print(json.dumps(cej_scraper.record, ensure_ascii=False),
+                      file=self.records_file)
+            totals["expedientes"] += 1
+            totals["avoided_submits"] += getattr(cej_scraper,
+                                                 "n_avoided_submits", 0)
+            if not args.silent:
+                print_error_summary(expediente, cej_scraper, retries,
+                                    n_downloads)
+
+        if log_path:
+            with open(log_path, "w") as log_file:
+                print_error_summary(expediente, cej_scraper, retries,
+                                    n_downloads, log_file)
+                if cej_scraper.log:
+                    print(cej_scraper.log, file=log_file)
+
+    def process_all(self, expedientes):
+        if self.args.workers == 1:
+            for expediente in expedientes:
+                self.process(expediente)
+            return
+
+        # Bound the number of pending jobs so the input is consumed lazily.
+        # An expediente of the queue is only leased once a worker is free
+        # for it, so that other nodes can take the rest.
+        n_slots = self.args.workers
+        if self.queue is None:
+            n_slots *= 2
+        slots = threading.BoundedSemaphore(n_slots)
+
+        def _job(expediente):
+            try:
+                self.process(expediente)
+            except Exception as ex:
+                with print_lock:
+                    print("Expediente: %s. Unexpected error: %s" %
+                          (expediente, ex), file=sys.stderr)
+            finally:
+                slots.release()
+
+        expedientes = iter(expedientes)
+        with ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            while True:
+                # The slot is taken before the next expediente is read.
+                slots.acquire()
+                expediente = next(expedientes, None)
+                if expediente is None:
+                    break
+                executor.submit(_job, expediente)
+
+
+def get_status(cej_scraper):
+    if not cej_scraper.error_message:
+        return STATUS_DONE
+    if "No se encontraron registros" in cej_scraper.error_message:
+        return STATUS_NOT_FOUND
+    return STATUS_FAILED
+
+
 if __name__ == "__main__":
+    # Only needs PIL, the OCR engines are loaded by the backends.
+    from pjscrap import captcha
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--headless",
@@ -30,8 +303,9 @@ if __name__ == "__main__":
                         required=False)
     parser.add_argument("-i", "--input",
                         type=argparse.FileType("r"),
-                        help="Archivo con lista de códigos de expediente",
-                        required=True)
+                        help="Archivo con lista de códigos de expediente "
+                             "('-' para leerla de stdin)",
+                        required=False)
     parser.add_argument("-r", "--retries",
                         type=int,
                         default=10,
@@ -39,7 +313,7 @@ if __name__ == "__main__":
                         required=False)
     parser.add_argument("-o", "--output",
                         help="Output folder path",
-                        required=True)
+                        required=False)
     parser.add_argument("--skip-existing-dir",
                         action="store_true",
                         required=False)
@@ -57,64 +331,364 @@ if __name__ == "__main__":
     parser.add_argument("--use-selenium",
                         action="store_true",
                         required=False)
+    parser.add_argument("--hybrid",
+                        action="store_true",
+                        help="Solve the captcha in Firefox and do the "
+                             "search and the downloads over HTTP",
+                        required=False)
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=1,
+                        help="Number of expedientes processed concurrently",
+                        required=False)
+    parser.add_argument("--ocr-workers",
+                        type=int,
+                        default=None,
+                        help="Number of processes solving captchas "
+                             "(defaults to the number of CPUs)",
+                        required=False)
+    parser.add_argument("--captcha-backend",
+                        default=None,
+                        help="Captcha OCR backend: auto (the first "
+                             "available one) or one of %s" %
+                             ", ".join(captcha.BACKENDS),
+                        required=False)
+    parser.add_argument("--captcha-profile",
+                        help="Captcha preprocessing profile written by "
+                             "captcha_tune.py",
+                        required=False)
+    parser.add_argument("--captcha-length",
+                        type=int,
+                        default=None,
+                        help="Expected number of characters of the captcha; "
+                             "other answers are not submitted",
+                        required=False)
+    parser.add_argument("--captcha-min-confidence",
+                        type=float,
+                        default=0.0,
+                        help="Answers below this OCR confidence (0-1) are "
+                             "not submitted",
+                        required=False)
+    parser.add_argument("--captcha-max-refetch",
+                        type=int,
+                        default=5,
+                        help="Captchas fetched before submitting a doubtful "
+                             "answer anyway",
+                        required=False)
+    parser.add_argument("--record-captchas",
+                        metavar="CORPUS_DIR",
+                        help="Save every submitted captcha with its answer "
+                             "and the server verdict",
+                        required=False)
+    parser.add_argument("--prefetch",
+                        type=int,
+                        default=0,
+                        help="Number of captchas fetched and solved ahead "
+                             "of time in the background (0 disables it)",
+                        required=False)
+    parser.add_argument("--manifest",
+                        help="SQLite file recording the state of every "
+                             "expediente; finished ones are skipped",
+                        required=False)
+    parser.add_argument("--retry-failed",
+                        action="store_true",
+                        help="Process the unfinished expedientes of "
+                             "--manifest instead of --input",
+                        required=False)
+    parser.add_argument("--validation-cache",
+                        help="SQLite file caching the validation of already "
+                             "downloaded resoluciones",
+                        required=False)
+    parser.add_argument("--deep-validation",
+                        action="store_true",
+                        help="Parse existing resoluciones before skipping "
+                             "them instead of only checking their structure",
+                        required=False)
+    parser.add_argument("--download-workers",
+                        type=int,
+                        default=4,
+                        help="Resoluciones of an expediente downloaded "
+                             "concurrently",
+                        required=False)
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        help="Only download resoluciones that are new or "
+                             "changed since the previous run",
+                        required=False)
+    parser.add_argument("--metadata-only",
+                        action="store_true",
+                        help="Do not download anything, write the case "
+                             "header and the resoluciones of every "
+                             "expediente as JSONL instead. --manifest is "
+                             "not updated",
+                        required=False)
+    parser.add_argument("--metadata-output",
+                        default="-",
+                        help="JSONL file of --metadata-only, appended to "
+                             "('-' for stdout)",
+                        required=False)
+    parser.add_argument("--store",
+                        metavar="STORE_DIR",
+                        help="Keep a single copy of each resolución under "
+                             "its sha256 in this directory and link it into "
+                             "the expediente folders",
+                        required=False)
+    parser.add_argument("--store-mode",
+                        choices=["hardlink", "manifest"],
+                        default="hardlink",
+                        help="hardlink: expediente folders get hardlinks "
+                             "(copies across filesystems); manifest: they "
+                             "only get a .objects.json listing the digests",
+                        required=False)
+    parser.add_argument("--base-url",
+                        help="CEJ base URL, e.g. a local stand-in server "
+                             "(defaults to $CEJ_BASE_URL or the real CEJ)",
+                        required=False)
+    parser.add_argument("--driver-max-jobs",
+                        type=int,
+                        default=50,
+                        help="Expedientes processed by a Firefox instance "
+                             "before it is restarted (0 disables recycling)",
+                        required=False)
+    parser.add_argument("--throttle",
+                        action="store_true",
+                        help="Adapt the requests in flight and their rate "
+                             "to the health of the server; --workers is "
+                             "then an upper bound (ignored with "
+                             "--use-selenium)",
+                        required=False)
+    parser.add_argument("--metrics-jsonl",
+                        help="Append the timing of every stage (captcha, "
+                             "validation, search, detail, downloads) to "
+                             "this JSONL file",
+                        required=False)
+    parser.add_argument("--metrics-textfile",
+                        help="Prometheus textfile with the stage metrics, "
+                             "rewritten during the run",
+                        required=False)
+    parser.add_argument("--metrics-interval",
+                        type=float,
+                        default=15,
+                        help="Seconds between rewrites of --metrics-textfile",
+                        required=False)
+    parser.add_argument("--shard",
+                        metavar="I/N",
+                        help="Only process the expedientes of shard I of N "
+                             "(0 <= I < N), so that N nodes can split the "
+                             "same list",
+                        required=False)
+    parser.add_argument("--queue",
+                        help="SQLite work queue shared by the workers of "
+                             "any number of processes or nodes; --input "
+                             "is added to it, and without --input the "
+                             "process joins the running batch",
+                        required=False)
+    parser.add_argument("--queue-shared-fs",
+                        action="store_true",
+                        help="The --queue file is on a network filesystem",
+                        required=False)
+    parser.add_argument("--lease-timeout",
+                        type=float,
+                        default=300,
+                        help="Seconds without heartbeat after which the "
+                             "expediente of a crashed worker is reclaimed",
+                        required=False)
+    parser.add_argument("--max-attempts",
+                        type=int,
+                        default=3,
+                        help="Leases of a queued expediente before it is "
+                             "marked as failed",
+                        required=False)
+    parser.add_argument("--reuse-session",
+                        action="store_true",
+                        help="Search further expedientes with an already "
+                             "validated captcha until the server rejects it "
+                             "(ignored with --use-selenium)",
+                        required=False)
 
     args = parser.parse_args()
 
-    if "pjscrap" not in sys.modules:
-        root_dir = \
-            os.path.abspath(os.path.join(os.path.os.getcwd(), os.pardir))
-        sys.path.append(root_dir)
-        from pjscrap.utils import setup_ssl
-        if args.use_selenium:
-            from pjscrap.cej import CejScraper
-        else:
-            from pjscrap.cej import CejScraperSimple
+    if not args.output and not args.metadata_only:
+        parser.error("--output is required")
+    # Only used by --skip-existing-dir without downloads.
+    args.output = args.output or os.curdir
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.hybrid and args.use_selenium:
+        parser.error("--hybrid and --use-selenium are exclusive")
+    if args.retry_failed and not args.manifest:
+        parser.error("--retry-failed requires --manifest")
+    if not args.input and not args.retry_failed and not args.queue:
+        parser.error("--input is required")
 
+    from pjscrap.cej import BASE_URL
+    from pjscrap.expedientes import CodeStream
+    from pjscrap.expedientes import parse_shard
+    from pjscrap.manifest import RunManifest
+    from pjscrap.manifest import STATUS_DONE
+    from pjscrap.manifest import STATUS_FAILED
+    from pjscrap.manifest import STATUS_NOT_FOUND
+    from pjscrap.metrics import MetricsRecorder
+    from pjscrap.metrics import STAGE_EXPEDIENTE
+    from pjscrap.metrics import TextfileWriter
+    from pjscrap.store import ContentStore
+    from pjscrap.utils import DEFAULT_POOL_SIZE
+    from pjscrap.utils import create_session
+    from pjscrap.utils import setup_ssl
+    from pjscrap.validation import ValidationCache
+    from pjscrap.validation import check_file
+    from pjscrap.workqueue import Heartbeat
+    from pjscrap.workqueue import WorkQueue
+    from pjscrap.workqueue import default_owner
+    from pjscrap.workqueue import leased
+    # Selenium and OpenCV are only loaded by the modes that use them.
+    if args.record_captchas:
+        from pjscrap.corpus import CaptchaCorpus
+    if args.use_selenium or args.hybrid:
+        from pjscrap.cej import TARGET_PATH
+        from pjscrap.drivers import DriverPool
+        from pjscrap.drivers import firefox_factory
     if args.use_selenium:
-        from selenium import webdriver
-        from selenium.webdriver.firefox.options import Options
+        from pjscrap.browser import CejScraper
+    else:
+        from pjscrap.cej import CAPTCHA_PATH
+        from pjscrap.cej import CaptchaSession
+        from pjscrap.cej import CejScraperSimple
+        from pjscrap.prefetch import CaptchaPrefetcher
+        from pjscrap.throttle import Throttle
+    if args.hybrid:
+        from pjscrap.browser import CejScraperHybrid
+
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as ex:
+            parser.error(str(ex))
+
     setup_ssl()
 
-    for line in args.input.readlines():
-        expediente = line.strip()
-        if not expediente:
-            continue
+    args.base_url = (args.base_url or BASE_URL).rstrip("/") + "/"
 
-        if args.use_selenium:
-            options = Options()
-            options.headless = args.headless
-            driver = webdriver.Firefox(options=options)
-            cej_scraper = CejScraper(driver, args.debug)
-        else:
-            session = requests.Session()
-            cej_scraper = CejScraperSimple(session, expediente, args.debug)
+    driver_pool = None
+    if args.use_selenium or args.hybrid:
+        driver_pool = DriverPool(firefox_factory(args.headless), args.workers,
+                                 os.path.join(args.base_url, TARGET_PATH),
+                                 args.driver_max_jobs)
 
-        output_dir = os.path.abspath(os.path.join(args.output, expediente))
-        log_path = os.path.join(args.log_dir, "%s.log" % expediente)
-        if args.skip_existing_dir and os.path.exists(output_dir):
+    profile = None
+    if args.captcha_profile:
+        profile = captcha.load_profile(args.captcha_profile)
+
+    corpus = None
+    if args.record_captchas:
+        corpus = CaptchaCorpus(args.record_captchas)
+
+    manifest = None
+    if args.manifest:
+        manifest = RunManifest(args.manifest)
+
+    store = None
+    if args.store:
+        store = ContentStore(args.store, args.store_mode)
+
+    if args.validation_cache:
+        validation_cache = ValidationCache(args.validation_cache,
+                                           args.deep_validation)
+        validator = validation_cache.check
+    else:
+        validation_cache = None
+        validator = functools.partial(check_file, deep=args.deep_validation)
+
+    if args.retry_failed:
+        lines = manifest.unfinished()
+    else:
+        lines = args.input
+    code_stream = None
+    if lines is not None:
+        code_stream = CodeStream(lines, shard,
+                                 None if args.silent else print_invalid_code)
+    expedientes = code_stream
+
+    queue = None
+    owner = None
+    if args.queue:
+        queue = WorkQueue(args.queue, args.lease_timeout, args.max_attempts,
+                          args.queue_shared_fs)
+        owner = default_owner()
+        if code_stream is not None:
+            n_added = queue.enqueue(code_stream)
             if not args.silent:
-                print_skip_summary(expediente)
-            if args.log_dir:
-                with open(log_path, "w") as log_file:
-                    print_skip_summary(expediente, log_file)
+                print_queue_summary(n_added, code_stream)
+        expedientes = leased(queue, owner,
+                             min(5.0, args.lease_timeout / 3))
 
-        if args.use_selenium:
-            _, _, retries, n_downloads =\
-                cej_scraper.run(expediente, output_dir, args.force,
-                                args.retries)
+    with ExitStack() as stack:
+        if driver_pool is not None:
+            stack.callback(driver_pool.close)
+        if manifest is not None:
+            stack.callback(manifest.close)
+        if validation_cache is not None:
+            stack.callback(validation_cache.close)
+        if store is not None:
+            stack.callback(store.close)
+
+        records_file = None
+        if args.metadata_only:
+            if args.metadata_output == "-":
+                records_file = sys.stdout
+            else:
+                records_file = stack.enter_context(
+                    open(args.metadata_output, "a", buffering=1))
+        if queue is not None:
+            stack.callback(queue.close)
+            # Leases left by an interruption go back to the queue.
+            stack.callback(queue.release, owner)
+            stack.enter_context(Heartbeat(queue, owner))
+
+        recorder = None
+        if args.metrics_jsonl or args.metrics_textfile:
+            recorder = MetricsRecorder(args.metrics_jsonl)
+            stack.callback(recorder.close)
+            if args.metrics_textfile:
+                stack.enter_context(
+                    TextfileWriter(recorder, args.metrics_textfile,
+                                   args.metrics_interval))
+
+        if args.workers == 1:
+            solver = functools.partial(captcha.solve_detailed,
+                                       backend=args.captcha_backend,
+                                       profile=profile)
         else:
-            _, _, retries, n_downloads =\
-                cej_scraper.run(output_dir, args.force, args.retries)
+            pool = stack.enter_context(
+                ProcessPoolExecutor(max_workers=args.ocr_workers))
+            solver = captcha.PoolSolver(pool, args.captcha_backend, profile)
 
-        if not args.silent:
-            print_error_summary(expediente, cej_scraper, retries, n_downloads)
+        throttle = None
+        if args.throttle and not args.use_selenium:
+            throttle = Throttle()
 
-        if args.log_dir:
-            with open(log_path, "w") as log_file:
-                print_error_summary(expediente, cej_scraper, retries,
-                                    n_downloads, log_file)
-                if cej_scraper.log:
-                    print(cej_scraper.log, file=log_file)
+        prefetcher = None
+        if args.prefetch and not (args.use_selenium or args.hybrid):
+            prefetcher = CaptchaPrefetcher(
+                os.path.join(args.base_url, CAPTCHA_PATH), solver,
+                args.prefetch, min(args.prefetch, args.workers),
+                debug=args.debug, throttle=throttle, recorder=recorder)
+            stack.enter_context(prefetcher)
 
-        if args.use_selenium:
-            driver.quit()
+        # A metadata-only run downloads nothing, so it must not mark the
+        # expedientes of the manifest as done; it may still read its
+        # unfinished ones with --retry-failed.
+        batch = Batch(args, solver, driver_pool, corpus, prefetcher,
+                      None if args.metadata_only else manifest, validator,
+                      throttle, recorder, queue, owner, store, records_file)
+        batch.process_all(expedientes)
+
+    if not args.silent:
+        if code_stream is not None:
+            print_input_summary(code_stream)
+        print_totals(batch.captcha_coverage())
+        if throttle is not None:
+            print_throttle_stats(throttle)
+        if store is not None:
+            print_store_stats(store)
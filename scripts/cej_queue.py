@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+import time
+
+
+def format_age(seconds):
+    if seconds is None:
+        return "-"
+    return "%.0fs" % seconds
+
+
+def print_status(stats, output_file=sys.stdout):
+    counts = stats.counts
+    print("Pending: %d. Leased: %d. Done: %d. Not found: %d. Failed: %d" %
+          (counts[STATUS_PENDING], counts[STATUS_LEASED],
+           counts[STATUS_DONE], counts[STATUS_NOT_FOUND],
+           counts[STATUS_FAILED]), file=output_file)
+    print("Workers: %d. Oldest lease: %s. Oldest heartbeat: %s. "
+          "Expired leases: %d" %
+          (stats.n_owners, format_age(stats.oldest_lease_age),
+           format_age(stats.oldest_heartbeat_age), stats.n_expired),
+          file=output_file)
+
+    remaining = counts[STATUS_PENDING] + counts[STATUS_LEASED]
+    eta = "-"
+    if stats.throughput > 0:
+        eta = "%.0f min" % (remaining / stats.throughput / 60)
+    print("Throughput: %.1f expedientes/min. ETA: %s" %
+          (60 * stats.throughput, eta), file=output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("queue",
+                        help="Work queue of cej_download.py --queue")
+    parser.add_argument("command",
+                        choices=["status", "add", "retry-failed"],
+                        help="status: depth, leases and throughput; add: "
+                             "queue the codes of --input; retry-failed: "
+                             "queue the failed expedientes again")
+    parser.add_argument("-i", "--input",
+                        type=argparse.FileType("r"),
+                        help="Archivo con lista de códigos de expediente "
+                             "('-' para leerla de stdin)",
+                        required=False)
+    parser.add_argument("--shared-fs",
+                        action="store_true",
+                        help="The queue file is on a network filesystem",
+                        required=False)
+    parser.add_argument("--watch",
+                        type=float,
+                        default=0,
+                        help="Print the status every this many seconds",
+                        required=False)
+
+    args = parser.parse_args()
+
+    if args.command == "add" and not args.input:
+        parser.error("add requires --input")
+
+    from pjscrap.expedientes import CodeStream
+    from pjscrap.workqueue import STATUS_DONE
+    from pjscrap.workqueue import STATUS_FAILED
+    from pjscrap.workqueue import STATUS_LEASED
+    from pjscrap.workqueue import STATUS_NOT_FOUND
+    from pjscrap.workqueue import STATUS_PENDING
+    from pjscrap.workqueue import WorkQueue
+
+    queue = WorkQueue(args.queue, shared_fs=args.shared_fs)
+    try:
+        if args.command == "add":
+            code_stream = CodeStream(args.input)
+            n_added = queue.enqueue(code_stream)
+            print("Queued: %d new of %d expedientes. Invalid: %d. "
+                  "Duplicates: %d" %
+                  (n_added, len(code_stream.seen), code_stream.n_invalid,
+                   code_stream.n_duplicates))
+        elif args.command == "retry-failed":
+            print("Queued again: %d" % queue.requeue_failed())
+        else:
+            print_status(queue.stats())
+            while args.watch:
+                time.sleep(args.watch)
+                print()
+                print_status(queue.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from pjscrap import captcha
+
+
+CAPTCHA_SIZE = (40, 130)
+NOT_FOUND_SUFFIX = "-00"
+
+
+class StandinConfig:
+    def __init__(self, latency=0.0, latency_jitter=0.0, captcha_length=4,
+                 rate_cv=0.0, rate_cm=0.0, rate_c=0.0, rate_5xx=0.0,
+                 file_size=64 * 1024,
+                 max_resoluciones=10, accept_any_captcha=False,
+                 leak_answer=False, max_searches_per_captcha=0, capacity=0,
+                 seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.captcha_length = captcha_length
+        self.rate_cv = rate_cv
+        self.rate_cm = rate_cm
+        # Right answers rejected anyway with "-C".
+        self.rate_c = rate_c
+        self.rate_5xx = rate_5xx
+        self.file_size = file_size
+        self.max_resoluciones = max_resoluciones
+        self.accept_any_captcha = accept_any_captcha
+        self.leak_answer = leak_answer
+        # Searches allowed on a validated session before a new captcha is
+        # required, 0 for no limit.
+        self.max_searches_per_captcha = max_searches_per_captcha
+        # Requests in flight that the server handles well, 0 for no limit.
+        # Beyond it, it slows down and fails more, as CEJ does under load.
+        self.capacity = capacity
+        self.seed = seed
+
+
+# CEJ draws light characters on a dark, noisy background: thresholding
+# and inverting makes them dark on white, and the erosion of
+# captcha.preprocess then thickens them. The background and the noise lines
+# stay under DEFAULT_PROFILE.threshold, the characters above it.
+CAPTCHA_FONT = cv2.FONT_HERSHEY_SIMPLEX
+CAPTCHA_FONT_SCALE = 0.7
+CAPTCHA_GLYPH_WIDTH = 26
+CAPTCHA_BACKGROUND = (60, 110)
+CAPTCHA_LINE = 125
+CAPTCHA_INK = (200, 250)
+
+_glyphs = None
+_glyphs_lock = threading.Lock()
+
+
+def _get_glyphs():
+    # cv2.putText initializes its fonts once per thread, which is slower
+    # than a whole request, so glyphs are rendered once and then pasted.
+    global _glyphs
+    with _glyphs_lock:
+        if _glyphs is None:
+            height = CAPTCHA_SIZE[0]
+            _glyphs = {}
+            for char in captcha.WHITELIST:
+                glyph = np.zeros((height, CAPTCHA_GLYPH_WIDTH), np.uint8)
+                cv2.putText(glyph, char, (3, 28), CAPTCHA_FONT,
+                            CAPTCHA_FONT_SCALE, 255, 1, cv2.LINE_AA)
+                # Coverage in [0, 1], scaled by the brightness of each char.
+                _glyphs[char] = glyph / 255.0
+        return _glyphs
+
+
+def render_captcha(answer, rng):
+    height, width = CAPTCHA_SIZE
+    noise_rng = np.random.default_rng(rng.getrandbits(32))
+    img = noise_rng.integers(*CAPTCHA_BACKGROUND, size=(height, width),
+                             dtype=np.uint8)
+    for _ in range(4):
+        start = (int(rng.randint(0, width)), int(rng.randint(0, height)))
+        end = (int(rng.randint(0, width)), int(rng.randint(0, height)))
+        cv2.line(img, start, end, CAPTCHA_LINE, 1)
+
+    glyphs = _get_glyphs()
+    x = 12
+    for char in answer:
+        # Every character moves and shines a little on its own.
+        dx, dy = rng.randint(-2, 2), rng.randint(-3, 3)
+        glyph = np.roll(glyphs[char], dy, axis=0) * rng.randint(*CAPTCHA_INK)
+        start = min(max(0, x + dx), width)
+        region = img[:, start:start + CAPTCHA_GLYPH_WIDTH]
+        np.maximum(region, glyph[:, :region.shape[1]].astype(np.uint8),
+                   out=region)
+        x += CAPTCHA_GLYPH_WIDTH
+
+    _, data = cv2.imencode(".jpg", cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))
+    return data.tobytes()
+
+
+def fake_pdf(size, seed):
+    header = b"%PDF-1.4\n% pjscrap stand-in " + seed.encode("ascii") + b"\n"
+    trailer = b"\n%%EOF\n"
+    body = b"0" * max(0, size - len(header) - len(trailer))
+    return header + body + trailer
+
+
+def _expediente_seed(expediente):
+    return int(hashlib.sha1(expediente.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class StandinState:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.registros = {}
+        self.rng = random.Random(config.seed)
+        self.in_flight = 0
+
+    def overload(self):
+        """Returns how far beyond its capacity the server is, from 0."""
+        capacity = self.config.capacity
+        if not capacity:
+            return 0.0
+        return max(0.0, (self.in_flight - capacity) / capacity)
+
+    def new_session(self):
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[session_id] = {"answer": None, "validated": False,
+                                         "n_searches": 0}
+        return session_id
+
+    def n_resoluciones(self, expediente):
+        if expediente.endswith(NOT_FOUND_SUFFIX):
+            return None
+        return _expediente_seed(expediente) % (self.config.max_resoluciones +
+                                               1)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer the response so that headers and body leave in one segment.
+    wbufsize = -1
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        # The body is always consumed so that the keep-alive connection stays
+        # usable even when an error is injected.
+        self.form = self._read_form() if method == "POST" else {}
+
+        with self.state.lock:
+            self.state.in_flight += 1
+        try:
+            self._dispatch(method)
+        finally:
+            with self.state.lock:
+                self.state.in_flight -= 1
+
+    def _dispatch(self, method):
+        config = self.state.config
+        overload = self.state.overload()
+        delay = (config.latency + self.state.rng.random() *
+                 config.latency_jitter) * (1 + overload)
+        if delay:
+            time.sleep(delay)
+
+        path = urlsplit(self.path).path
+        routes = {
+            ("GET", "/cej/Captcha.jpg"): self._captcha,
+            ("POST", "/cej/forms/ValidarFiltrosCodigo.htm"): self._validate,
+            ("POST", "/cej/forms/busquedacodform.html"): self._search,
+            ("POST", "/cej/forms/detalleform.html"): self._detail,
+            ("GET", "/cej/forms/documentoD.html"): self._document,
+        }
+        handler = routes.get((method, path))
+        if handler is None:
+            self._send(404, b"Not found")
+            return
+        if self.state.rng.random() < config.rate_5xx + overload / 2:
+            self._send(503, b"Service Unavailable")
+            return
+        handler()
+
+    def _send(self, status, body, content_type="text/html; charset=utf-8",
+              headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_form(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = parse_qs(self.rfile.read(length).decode("utf-8"))
+        return {key: values[0] for key, values in data.items()}
+
+    def _session(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        if "JSESSIONID" not in cookie:
+            return None, None
+        session_id = cookie["JSESSIONID"].value
+        return session_id, self.state.sessions.get(session_id)
+
+    def _captcha(self):
+        session_id, session = self._session()
+        headers = {}
+        if session is None:
+            session_id = self.state.new_session()
+            session = self.state.sessions[session_id]
+            headers["Set-Cookie"] = "JSESSIONID=%s; Path=/cej" % session_id
+
+        rng = self.state.rng
+        answer = "".join(rng.choice(captcha.WHITELIST)
+                         for _ in range(self.state.config.captcha_length))
+        with self.state.lock:
+            session["answer"] = answer
+            session["validated"] = False
+            session["n_searches"] = 0
+        if self.state.config.leak_answer:
+            headers["X-Captcha-Answer"] = answer
+
+        self._send(200, render_captcha(answer, rng), "image/jpeg", headers)
+
+    def _validate(self):
+        config = self.state.config
+        form = self.form
+        _, session = self._session()
+        rng = self.state.rng
+
+        if session is None or session["answer"] is None:
+            result = "-CV"
+        elif rng.random() < config.rate_cv:
+            result = "-CV"
+        elif rng.random() < config.rate_cm + self.state.overload() / 2:
+            result = "-CM"
+        elif not config.accept_any_captcha and \
+                form.get("codigoCaptcha") != session["answer"]:
+            result = "-C"
+        elif rng.random() < config.rate_c:
+            result = "-C"
+        else:
+            expediente = "-".join(form.get(key, "") for key in (
+                "cod_expediente", "cod_anio", "cod_incidente",
+                "cod_distprov", "cod_organo", "cod_especialidad",
+                "cod_instancia"))
+            if self.state.n_resoluciones(expediente) is None:
+                result = "2"
+            else:
+                result = "1"
+                with self.state.lock:
+                    session["validated"] = True
+
+        if session is not None:
+            # A captcha can only be submitted once.
+            with self.state.lock:
+                session["answer"] = None
+        self._send(200, result.encode("utf-8"), "text/plain")
+
+    def _search(self):
+        form = self.form
+        _, session = self._session()
+        if session is None or not session["validated"]:
+            self._send(200, b"<html><body></body></html>")
+            return
+
+        max_searches = self.state.config.max_searches_per_captcha
+        with self.state.lock:
+            session["n_searches"] += 1
+            if max_searches and session["n_searches"] > max_searches:
+                session["validated"] = False
+        if not session["validated"]:
+            self._send(200, b"<html><body></body></html>")
+            return
+
+        expediente = "-".join(form.get(key, "") for key in (
+            "cod_expediente", "cod_anio", "cod_incidente", "cod_distprov",
+            "cod_organo", "cod_especialidad", "cod_instancia"))
+        rows = ""
+        if self.state.n_resoluciones(expediente) is not None:
+            nro_registro = str(_expediente_seed(expediente))
+            with self.state.lock:
+                self.state.registros[nro_registro] = expediente
+            rows = ('<div class="divNroExp1"><b>%s</b>'
+                    '<input type="hidden" value="%s"/>'
+                    '<button type="button">Ver</button></div>') % \
+                (expediente, nro_registro)
+
+        body = ('<html><body><div id="divDetalles">%s</div></body></html>' %
+                rows)
+        self._send(200, body.encode("utf-8"))
+
+    def _detail(self):
+        form = self.form
+        _, session = self._session()
+        expediente = self.state.registros.get(form.get("nroRegistro"))
+        if session is None or not session["validated"] or expediente is None:
+            self._send(200, b"<html><body></body></html>")
+            return
+
+        rows = []
+        for i in range(self.state.n_resoluciones(expediente)):
+            rows.append(
+                '<div class="celdaGrid"><span>Acto: RESOLUCION %d</span>'
+                '<span>Fecha: 2020-01-%02d</span>'
+                '<a class="aDescarg" href="documentoD.html?nid=%s.%d">'
+                'Descargar</a></div>' % (i + 1, i % 28 + 1,
+                                         form.get("nroRegistro"), i))
+        body = ('<html><body><div class="cabecera"><b>%s</b></div>%s'
+                '</body></html>') % (expediente, "".join(rows))
+        self._send(200, body.encode("utf-8"))
+
+    def _document(self):
+        nid = parse_qs(urlsplit(self.path).query).get("nid", [""])[0]
+        if not re.match(r"^[0-9]+\.[0-9]+$", nid):
+            self._send(404, b"Not found")
+            return
+
+        content = fake_pdf(self.state.config.file_size, nid)
+        headers = {
+            "Content-disposition": 'attachment; filename="%s.pdf"' % nid,
+            "Accept-Ranges": "bytes",
+        }
+
+        match = re.match(r"^bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match and int(match.group(1)) < len(content):
+            start = int(match.group(1))
+            headers["Content-Range"] = "bytes %d-%d/%d" % \
+                (start, len(content) - 1, len(content))
+            self._send(206, content[start:], "application/pdf", headers)
+            return
+        self._send(200, content, "application/pdf", headers)
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandinServer:
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.state = StandinState(config or StandinConfig())
+        handler = type("BoundStandinHandler", (StandinHandler,),
+                       {"state": self.state})
+        self.httpd = _QuietHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d/cej/" % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+# What each kind of process imports before doing any work.
+MODES = {
+    "python": "",
+    "package": "import pjscrap",
+    "http": "from pjscrap.cej import CejScraperSimple\n"
+            "from pjscrap import captcha, prefetch, throttle, utils",
+    "ocr-worker": "from pjscrap import captcha, glyphs",
+    "selenium": "from pjscrap.browser import CejScraper\n"
+                "from pjscrap import drivers",
+}
+HEAVY_MODULES = ("cv2", "numpy", "pytesseract", "selenium", "bs4", "PIL")
+
+# Runs in a fresh interpreter, so that nothing is imported beforehand.
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], "<mode>", "exec"))
+elapsed = time.perf_counter() - start
+rss = 0
+with open("/proc/self/status") as status:
+    for line in status:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+print(json.dumps({"elapsed": elapsed, "rss": rss,
+                  "modules": sorted(set(sys.modules) & set(%r))}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(code, repeat):
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", CHILD, code],
+                                check=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE).stdout
+        results.append(json.loads(output))
+    return results
+
+
+def print_result(name, results):
+    elapsed = [result["elapsed"] for result in results]
+    rss = [result["rss"] for result in results]
+    print("%-12s import %7.1f ms (min %7.1f ms), RSS %6.1f MB. Loads: %s" %
+          (name, 1000 * statistics.median(elapsed), 1000 * min(elapsed),
+           statistics.median(rss) / 2 ** 20,
+           ", ".join(results[0]["modules"]) or "-"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the import time and the memory of a fresh "
+                    "process for each kind of pjscrap process")
+
+    parser.add_argument("modes",
+                        nargs="*",
+                        help="Modes to measure: %s (defaults to all of "
+                             "them)" % ", ".join(MODES))
+    parser.add_argument("-n", "--repeat",
+                        type=int,
+                        default=5,
+                        help="Fresh processes started for each mode",
+                        required=False)
+
+    args = parser.parse_args()
+
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error("unknown modes: %s" % ", ".join(sorted(unknown)))
+
+    for name in args.modes or MODES:
+        try:
+            results = measure(MODES[name], args.repeat)
+        except subprocess.CalledProcessError as ex:
+            error = ex.stderr.decode("utf-8", "replace").strip()
+            print("%-12s unavailable: %s" % (name, error.splitlines()[-1]))
+            continue
+        print_result(name, results)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import argparse
+import os
+import sys
+import time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("output",
+                        help="Output folder written by cej_download.py")
+    parser.add_argument("--deep",
+                        action="store_true",
+                        help="Parse every document instead of only checking "
+                             "its structure",
+                        required=False)
+    parser.add_argument("--cache",
+                        help="SQLite file caching validation results",
+                        required=False)
+    parser.add_argument("-w", "--workers",
+                        type=int,
+                        default=8,
+                        required=False)
+    parser.add_argument("--delete-invalid",
+                        action="store_true",
+                        help="Delete invalid files so the next run fetches "
+                             "them again",
+                        required=False)
+
+    args = parser.parse_args()
+
+    from pjscrap.validation import ValidationCache
+    from pjscrap.validation import validate_dir
+
+    cache = ValidationCache(args.cache, args.deep) if args.cache else None
+
+    start = time.perf_counter()
+    results = validate_dir(args.output, args.deep, cache, args.workers)
+    elapsed = time.perf_counter() - start
+
+    invalid = sorted(path for path, valid in results.items() if not valid)
+    for path in invalid:
+        print(path)
+        if args.delete_invalid:
+            os.remove(path)
+
+    print("Validated %d files in %.2fs. Invalid: %d" %
+          (len(results), elapsed, len(invalid)), file=sys.stderr)
+
+    if cache is not None:
+        cache.close()
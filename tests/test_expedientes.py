@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pjscrap.expedientes import CodeStream
+from pjscrap.expedientes import normalize
+from pjscrap.expedientes import pack
+from pjscrap.expedientes import parse_shard
+from pjscrap.expedientes import shard_of
+
+
+@pytest.mark.parametrize("code", [
+    "00123-2020-0-1801-JR-CI-01",
+    "123-2020-0-1801-JR-CI-1",
+    "  00123 2020 0 1801 jr ci 01\n",
+    "00123_2020_0_1801_JR_CI_01",
+    "00123/2020/0/1801/JR/CI/01",
+    "-00123--2020-0-1801-JR-CI-01-",
+])
+def test_normalize(code):
+    assert normalize(code) == "00123-2020-0-1801-JR-CI-01"
+
+
+@pytest.mark.parametrize("code", [
+    "",
+    "00123-2020-0-1801-JR-CI",
+    "00123-20-0-1801-JR-CI-01",
+    "123456-2020-0-1801-JR-CI-01",
+    "00123-2020-0-1801-J1-CI-01",
+])
+def test_normalize_rejects_invalid_codes(code):
+    with pytest.raises(ValueError):
+        normalize(code)
+
+
+def test_pack_is_injective_on_every_part():
+    codes = [
+        "00123-2020-0-1801-JR-CI-01",
+        "00124-2020-0-1801-JR-CI-01",
+        "00123-2021-0-1801-JR-CI-01",
+        "00123-2020-1-1801-JR-CI-01",
+        "00123-2020-0-1802-JR-CI-01",
+        "00123-2020-0-1801-JP-CI-01",
+        "00123-2020-0-1801-JR-LA-01",
+        "00123-2020-0-1801-JR-CI-02",
+    ]
+
+    assert len({pack(code) for code in codes}) == len(codes)
+
+
+def test_pack_fits_the_largest_code():
+    assert pack("99999-9999-999-9999-ZZ-ZZ-99") < 2 ** 82
+
+
+def test_shard_of_is_stable_and_in_range():
+    code = "00123-2020-0-1801-JR-CI-01"
+
+    assert shard_of(code, 7) == shard_of(code, 7)
+    assert all(0 <= shard_of("%05d-2020-0-1801-JR-CI-01" % i, 7) < 7
+               for i in range(100))
+
+
+def test_shards_partition_the_codes():
+    codes = ["%05d-2020-0-1801-JR-CI-01" % i for i in range(300)]
+
+    shards = [[code for code in codes if shard_of(code, 3) == index]
+              for index in range(3)]
+
+    assert sorted(sum(shards, [])) == codes
+    assert all(shards)
+
+
+@pytest.mark.parametrize("text, expected", [("0/1", (0, 1)),
+                                            (" 2/3 ", (2, 3))])
+def test_parse_shard(text, expected):
+    assert parse_shard(text) == expected
+
+
+@pytest.mark.parametrize("text", ["1/1", "0/0", "1", "-1/2", "a/b"])
+def test_parse_shard_rejects_invalid_shards(text):
+    with pytest.raises(ValueError):
+        parse_shard(text)
+
+
+def test_code_stream_counts_what_it_skips():
+    invalid = []
+    stream = CodeStream(["# comment\n", "\n", "123-2020-0-1801-JR-CI-1\n",
+                         "00123-2020-0-1801-JR-CI-01\n", "nonsense\n",
+                         "00124-2020-0-1801-JR-CI-01\n"],
+                        on_invalid=invalid.append)
+
+    assert list(stream) == ["00123-2020-0-1801-JR-CI-01",
+                            "00124-2020-0-1801-JR-CI-01"]
+    assert stream.n_duplicates == 1
+    assert stream.n_invalid == 1
+    assert invalid == ["nonsense"]
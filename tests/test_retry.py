@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import random
+
+from pjscrap.retry import DEFAULT_POLICIES
+from pjscrap.retry import Outcome
+from pjscrap.retry import RetryBudget
+from pjscrap.retry import RetryPolicy
+from pjscrap.retry import StateMachine
+from pjscrap.retry import StepError
+from pjscrap.retry import backoff_delay
+
+
+class CeilingRandom:
+    """Always draws the upper bound of the jitter window."""
+
+    def uniform(self, low, high):
+        return high
+
+
+def test_backoff_delay_doubles_up_to_the_maximum():
+    policy = RetryPolicy(10, 0.5, 3.0)
+    rng = CeilingRandom()
+
+    delays = [backoff_delay(policy, attempt, rng) for attempt in range(5)]
+
+    assert delays == [0.5, 1.0, 2.0, 3.0, 3.0]
+
+
+def test_backoff_delay_is_jittered_within_the_window():
+    policy = RetryPolicy(10, 0.5, 30.0)
+    rng = random.Random(1)
+
+    for attempt in range(8):
+        ceiling = min(30.0, 0.5 * 2 ** attempt)
+        assert 0 <= backoff_delay(policy, attempt, rng) <= ceiling
+
+
+def test_budget_limits_each_outcome():
+    budget = RetryBudget(100, rng=CeilingRandom())
+    max_retries = DEFAULT_POLICIES[Outcome.EXPIRED_CAPTCHA].max_retries
+
+    delays = [budget.next_delay(Outcome.EXPIRED_CAPTCHA)
+              for _ in range(max_retries)]
+
+    assert None not in delays
+    assert budget.next_delay(Outcome.EXPIRED_CAPTCHA) is None
+    # Other outcomes keep their own retries.
+    assert budget.next_delay(Outcome.WRONG_CAPTCHA) is not None
+
+
+def test_budget_limits_the_total():
+    budget = RetryBudget(2, rng=CeilingRandom())
+
+    assert budget.next_delay(Outcome.WRONG_CAPTCHA) is not None
+    assert budget.next_delay(Outcome.HTTP_ERROR) is not None
+    assert budget.next_delay(Outcome.PARSE_ERROR) is None
+    assert budget.retries == 0
+
+
+def test_not_found_is_never_retried():
+    budget = RetryBudget(10)
+
+    assert budget.next_delay(Outcome.NOT_FOUND) is None
+    assert budget.retries == 10
+
+
+def test_budget_accepts_custom_policies():
+    budget = RetryBudget(10, {Outcome.NOT_FOUND: RetryPolicy(1, 0.0, 0.0)})
+
+    assert budget.next_delay(Outcome.NOT_FOUND) == 0.0
+    assert budget.next_delay(Outcome.NOT_FOUND) is None
+    assert budget.policies[Outcome.HTTP_ERROR] == \
+        DEFAULT_POLICIES[Outcome.HTTP_ERROR]
+
+
+def test_state_machine_retries_from_the_given_state():
+    calls = []
+
+    def fetch():
+        calls.append("fetch")
+        return "search"
+
+    def search():
+        calls.append("search")
+        if calls.count("search") == 1:
+            raise StepError(Outcome.WRONG_CAPTCHA, "wrong", "fetch")
+        return "done"
+
+    machine = StateMachine({"fetch": fetch, "search": search},
+                           RetryBudget(5, rng=CeilingRandom()), "fetch",
+                           "failed", sleep=lambda delay: None)
+
+    assert machine.run("fetch") == "done"
+    assert calls == ["fetch", "search", "fetch", "search"]
+    assert machine.error is None
+
+
+def test_state_machine_fails_when_the_budget_is_exhausted():
+    def fetch():
+        raise ValueError("unexpected")
+
+    machine = StateMachine({"fetch": fetch}, RetryBudget(2), "fetch",
+                           "failed", sleep=lambda delay: None)
+
+    assert machine.run("fetch") == "failed"
+    assert machine.error.outcome == Outcome.ERROR
+    assert [t.state for t in machine.transitions] == \
+        ["fetch", "fetch", "fetch", "failed"]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import pytest
+
+from pjscrap import validation
+from pjscrap.store import LINK_MANIFEST
+from pjscrap.store import ContentStore
+from pjscrap.store import load_manifest
+
+
+def _downloaded(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path), hashlib.sha256(content).hexdigest(), len(content)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ContentStore(str(tmp_path / "store"))
+    yield store
+    store.close()
+
+
+def test_add_moves_the_file_into_the_store(tmp_path, store):
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+
+    stored = store.add(path, digest, size, "http://cej/a", "a.pdf")
+
+    assert not os.path.exists(path)
+    with open(store.object_path(digest), "rb") as f:
+        assert f.read() == b"content"
+    assert stored.filename == "a.pdf"
+    assert store.counts["stored"] == 1
+    assert store.counts["stored_bytes"] == size
+
+
+def test_add_deduplicates_by_digest(tmp_path, store):
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+    store.add(path, digest, size, "http://cej/a", "a.pdf")
+    # Same bytes under another URL and name.
+    path, digest, size = _downloaded(tmp_path, "b.part", b"content")
+
+    store.add(path, digest, size, "http://cej/b", "b.pdf")
+
+    assert not os.path.exists(path)
+    assert store.counts["stored"] == 1
+    assert store.counts["deduplicated"] == 1
+    assert store.counts["deduplicated_bytes"] == size
+
+
+def test_add_keeps_new_content_of_a_known_url(tmp_path, store):
+    path, digest_1, size = _downloaded(tmp_path, "a.part", b"first")
+    store.add(path, digest_1, size, "http://cej/a", "a.pdf")
+    path, digest_2, size = _downloaded(tmp_path, "a.part", b"second")
+
+    store.add(path, digest_2, size, "http://cej/a", "a.pdf")
+
+    assert os.path.exists(store.object_path(digest_1))
+    assert os.path.exists(store.object_path(digest_2))
+    assert store.counts["stored"] == 2
+
+
+def test_hardlink_mode_links_into_the_expediente(tmp_path, store):
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+    stored = store.add(path, digest, size, "http://cej/a", "a.pdf")
+    output_dir = tmp_path / "expediente"
+    output_dir.mkdir()
+
+    linked = store.link(stored, str(output_dir))
+
+    assert linked == str(output_dir / "a.pdf")
+    assert os.path.samefile(linked, store.object_path(digest))
+    assert os.listdir(str(output_dir)) == ["a.pdf"]
+
+
+def test_linking_again_leaves_a_single_file(tmp_path, store):
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+    stored = store.add(path, digest, size, "http://cej/a", "a.pdf")
+    output_dir = tmp_path / "expediente"
+    output_dir.mkdir()
+    store.link(stored, str(output_dir))
+
+    store.link(stored, str(output_dir))
+
+    assert os.listdir(str(output_dir)) == ["a.pdf"]
+
+
+def test_leftover_link_is_not_a_resolucion(tmp_path, store):
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+    stored = store.add(path, digest, size, "http://cej/a", "a.pdf")
+    output_dir = tmp_path / "expediente"
+    output_dir.mkdir()
+    # Left by a process killed before the rename.
+    os.link(store.object_path(digest), str(output_dir / ".a.pdf.link"))
+
+    assert list(validation.iter_files(str(output_dir))) == []
+    store.link(stored, str(output_dir))
+    assert os.listdir(str(output_dir)) == ["a.pdf"]
+
+
+def test_manifest_mode_returns_the_object(tmp_path):
+    store = ContentStore(str(tmp_path / "store"), LINK_MANIFEST)
+    path, digest, size = _downloaded(tmp_path, "a.part", b"content")
+    stored = store.add(path, digest, size, "http://cej/a", "a.pdf")
+    output_dir = tmp_path / "expediente"
+    output_dir.mkdir()
+
+    linked = store.link(stored, str(output_dir))
+    store.close()
+
+    assert linked == store.object_path(digest)
+    assert os.path.exists(linked)
+    assert load_manifest(str(output_dir)) == {
+        "a.pdf": {"digest": digest, "size": size}}
+
+
+def test_unknown_link_mode(tmp_path):
+    with pytest.raises(ValueError):
+        ContentStore(str(tmp_path / "store"), "symlink")
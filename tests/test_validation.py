@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pjscrap import validation
+from pjscrap.validation import OLE_MAGIC
+from pjscrap.validation import TYPE_MSWORD
+from pjscrap.validation import TYPE_PDF
+from pjscrap.validation import TYPE_ZIP
+from pjscrap.validation import ValidationCache
+
+
+def _write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+@pytest.mark.parametrize("content, expected", [
+    (b"%PDF-1.4\n1 0 obj\n%%EOF\n", (TYPE_PDF, True)),
+    (b"%PDF-1.4\n1 0 obj\n", (TYPE_PDF, False)),
+    (b"PK\x03\x04" + b"\0" * 100 + b"PK\x05\x06" + b"\0" * 18,
+     (TYPE_ZIP, True)),
+    (b"PK\x03\x04" + b"\0" * 100, (TYPE_ZIP, False)),
+    (OLE_MAGIC + b"\0" * 1024, (TYPE_MSWORD, True)),
+    (OLE_MAGIC + b"\0" * 16, (TYPE_MSWORD, False)),
+    # Unknown types are only checked for existence.
+    (b"plain text", (None, True)),
+    (b"", (None, True)),
+])
+def test_check_structure(tmp_path, content, expected):
+    path = _write(tmp_path, "resolucion", content)
+
+    assert validation._check_structure(path) == expected
+
+
+def test_check_structure_reads_only_the_tail_of_pdfs(tmp_path):
+    # An %%EOF far from the end is an earlier revision, not the end.
+    content = b"%PDF-1.4\n%%EOF\n" + b"x" * (validation.PDF_TAIL_SIZE * 2)
+    path = _write(tmp_path, "resolucion.pdf", content)
+
+    assert validation._check_structure(path) == (TYPE_PDF, False)
+
+
+def test_check_file_of_a_missing_file(tmp_path):
+    assert not validation.check_file(str(tmp_path / "missing.pdf"))
+
+
+@pytest.mark.parametrize("content", [
+    b"%PDF-1.4\n" + b"\xff" * 64 + b"\n%%EOF\n",
+    b"%PDF-1.4\ntrailer\n<< /Root 1 0 R /Size 1 >>\n%%EOF\n",
+])
+def test_deep_check_of_a_garbage_pdf(tmp_path, content):
+    pytest.importorskip("PyPDF2")
+    path = _write(tmp_path, "resolucion.pdf", content)
+
+    assert not validation.check_file(path, deep=True)
+
+
+def test_deep_check_of_a_garbage_docx(tmp_path):
+    pytest.importorskip("docx")
+    path = _write(tmp_path, "resolucion.docx",
+                  b"PK\x03\x04" + b"\0" * 100 + b"PK\x05\x06" + b"\0" * 18)
+
+    assert not validation.check_file(path, deep=True)
+
+
+def test_iter_files_skips_state_and_partial_files(tmp_path):
+    expediente_dir = tmp_path / "expediente"
+    expediente_dir.mkdir()
+    for name in ("a.pdf", ".listing.json", "b.pdf.part"):
+        (expediente_dir / name).write_bytes(b"")
+
+    assert list(validation.iter_files(str(tmp_path))) == \
+        [str(expediente_dir / "a.pdf")]
+
+
+def test_cache_is_invalidated_by_changes(tmp_path):
+    path = _write(tmp_path, "resolucion.pdf", b"%PDF-1.4\n%%EOF\n")
+    cache = ValidationCache(str(tmp_path / "cache.db"))
+
+    assert cache.lookup(path) is None
+    assert cache.check(path)
+    assert cache.lookup(path) is True
+
+    with open(path, "ab") as f:
+        f.write(b"x" * validation.PDF_TAIL_SIZE)
+    assert cache.lookup(path) is None
+    assert not cache.check(path)
+    cache.close()
+
+
+def test_cache_answers_deep_checks_only_with_deep_results(tmp_path):
+    path = _write(tmp_path, "resolucion.pdf", b"%PDF-1.4\n%%EOF\n")
+    cache = ValidationCache(str(tmp_path / "cache.db"))
+
+    cache.store(path, True, deep=False)
+    assert cache.lookup(path, deep=False) is True
+    assert cache.lookup(path, deep=True) is None
+    # A structurally broken file can not pass a deep check.
+    cache.store(path, False, deep=False)
+    assert cache.lookup(path, deep=True) is False
+    cache.store(path, True, deep=True)
+    assert cache.lookup(path, deep=False) is True
+    cache.close()
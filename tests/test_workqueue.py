@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pjscrap.workqueue import STATUS_DONE
+from pjscrap.workqueue import STATUS_FAILED
+from pjscrap.workqueue import STATUS_LEASED
+from pjscrap.workqueue import STATUS_NOT_FOUND
+from pjscrap.workqueue import STATUS_PENDING
+from pjscrap.workqueue import WorkQueue
+from pjscrap.workqueue import leased
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue(str(tmp_path / "queue.db"), lease_timeout=60,
+                      max_attempts=2, clock=clock)
+    yield queue
+    queue.close()
+
+
+def test_enqueue_ignores_queued_codes(queue):
+    assert queue.enqueue(["a", "b"]) == 2
+    assert queue.enqueue(["b", "c"]) == 1
+    assert queue.stats().counts[STATUS_PENDING] == 3
+
+
+def test_lease_in_enqueue_order(queue, clock):
+    queue.enqueue(["a"])
+    clock.now += 1
+    queue.enqueue(["b"])
+
+    assert queue.lease("w1") == "a"
+    assert queue.lease("w2") == "b"
+    assert queue.lease("w3") is None
+    assert queue.stats().counts[STATUS_LEASED] == 2
+
+
+def test_expired_lease_is_taken_over(queue, clock):
+    queue.enqueue(["a"])
+    assert queue.lease("w1") == "a"
+
+    clock.now += 61
+    assert queue.lease("w2") == "a"
+    # The first worker lost the lease.
+    assert not queue.finish("a", "w1", STATUS_DONE)
+    assert queue.finish("a", "w2", STATUS_DONE)
+    assert queue.stats().counts[STATUS_DONE] == 1
+
+
+def test_heartbeat_keeps_the_lease(queue, clock):
+    queue.enqueue(["a"])
+    queue.lease("w1")
+
+    clock.now += 50
+    assert queue.heartbeat("w1") == 1
+    clock.now += 50
+    assert queue.lease("w2") is None
+
+
+def test_pending_codes_are_leased_before_expired_ones(queue, clock):
+    queue.enqueue(["a"])
+    queue.lease("w1")
+    clock.now += 1
+    queue.enqueue(["b"])
+
+    clock.now += 61
+    assert queue.lease("w2") == "b"
+    assert queue.lease("w2") == "a"
+
+
+def test_lease_expiring_on_every_attempt_fails(queue, clock):
+    queue.enqueue(["a"])
+    for owner in ("w1", "w2"):
+        assert queue.lease(owner) == "a"
+        clock.now += 61
+
+    assert queue.lease("w3") is None
+    stats = queue.stats()
+    assert stats.counts[STATUS_FAILED] == 1
+    assert not queue.has_work()
+
+
+def test_failed_codes_are_retried_until_the_last_attempt(queue):
+    queue.enqueue(["a"])
+    queue.finish(queue.lease("w1"), "w1", STATUS_FAILED, "error")
+    assert queue.stats().counts[STATUS_PENDING] == 1
+
+    queue.finish(queue.lease("w1"), "w1", STATUS_FAILED, "error")
+    assert queue.stats().counts[STATUS_FAILED] == 1
+
+    assert queue.requeue_failed() == 1
+    assert queue.lease("w1") == "a"
+
+
+def test_release_does_not_count_an_attempt(queue):
+    queue.enqueue(["a"])
+    queue.lease("w1")
+    assert queue.release("w1") == 1
+
+    # Still two attempts left.
+    queue.finish(queue.lease("w2"), "w2", STATUS_FAILED)
+    assert queue.lease("w2") == "a"
+
+
+def test_queues_on_the_same_file_share_the_work(tmp_path, clock):
+    path = str(tmp_path / "queue.db")
+    first = WorkQueue(path, clock=clock)
+    second = WorkQueue(path, clock=clock)
+    first.enqueue(["a", "b"])
+
+    assert {first.lease("w1"), second.lease("w2")} == {"a", "b"}
+    assert first.lease("w1") is None
+    first.close()
+    second.close()
+
+
+def test_leased_polls_until_the_last_lease_expires(queue, clock):
+    queue.enqueue(["a", "b"])
+    queue.lease("crashed")
+    sleeps = []
+
+    def sleep(interval):
+        sleeps.append(interval)
+        clock.now += interval
+
+    codes = []
+    for code in leased(queue, "w1", poll_interval=30, sleep=sleep):
+        codes.append(code)
+        queue.finish(code, "w1", STATUS_NOT_FOUND)
+
+    assert codes == ["b", "a"]
+    assert sleeps == [30, 30, 30]